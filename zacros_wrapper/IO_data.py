@@ -3,12 +3,20 @@ import os
 import numpy as np
 import re as _re
 import random as _random
-import linecache as _linecache
+from itertools import islice as _islice
+from itertools import chain as _chain
+
+try:
+    from itertools import izip as _izip
+except ImportError:
+    _izip = zip
 
 from utils import constant as _c
 from utils import ReadWithoutBlankLines as _ReadWithoutBlankLines
 from utils import ReturnUnique as _ReturnUnique
 from utils import rawbigcount as _rawbigcount
+from utils import line_offsets as _line_offsets
+from utils import ReplaceFile as _ReplaceFile
 
 try:
     import DFT_to_Thermochemistry as _thermo
@@ -153,106 +161,123 @@ class SimIn():
         '''
 
         with open(os.path.join(fldr, self.fname), 'w') as txt:
-            SeedTxt = ''
-            if self.Seed is None:
-                _random.seed()
-                self.Seed = _random.randint(10000, 99999)
-                SeedTxt = '# Random seed from Python wrapper'
-
-            txt.write('#KMC simulation specification\n\n')
-            txt.write('{:20}{:15}{}\n\n'.format('random_seed',
-                      str(self.Seed), SeedTxt))
+            txt.write(self.RenderIn())
             
-            # Write out temperature, which depends on TPD or constant temperature mode
-            if self.TPD:
-                txt.write('{:20}{:5.1f}{:5.1f}\n'.format('temperature\t ramp', self.TPD_start, self.TPD_ramp))
-            else:
-                txt.write('{:20}{:5.1f}\n'.format('temperature', self.T))
-
-            txt.write('{:20}{:5.5e}\n\n'.format('pressure', self.P))
-            txt.write('{:20}{}\n'.format('n_gas_species',
-                      str(self.n_gas)))
-            txt.write('{:20}'.format('gas_specs_names'))
+            
+    def RenderIn(self, seed_field = None):
+    
+        '''
+        Text of simulation_input.dat
+        
+        :param seed_field: Text to write in place of the random seed, e.g. a placeholder which is
+            replaced for each trajectory
+        '''
+        
+        out = []
+        SeedTxt = ''
+        if self.Seed is None:
+            _random.seed()
+            self.Seed = _random.randint(10000, 99999)
+            SeedTxt = '# Random seed from Python wrapper'
+
+        out.append('#KMC simulation specification\n\n')
+        if seed_field is None:
+            seed_field = '{:15}'.format(str(self.Seed))
+        out.append('{:20}{}{}\n\n'.format('random_seed',
+                  seed_field, SeedTxt))
+        
+        # Write out temperature, which depends on TPD or constant temperature mode
+        if self.TPD:
+            out.append('{:20}{:5.1f}{:5.1f}\n'.format('temperature\t ramp', self.TPD_start, self.TPD_ramp))
+        else:
+            out.append('{:20}{:5.1f}\n'.format('temperature', self.T))
+
+        out.append('{:20}{:5.5e}\n\n'.format('pressure', self.P))
+        out.append('{:20}{}\n'.format('n_gas_species',
+                  str(self.n_gas)))
+        out.append('{:20}'.format('gas_specs_names'))
+        for i in range(0, self.n_gas):
+            out.append('{:15}'.format(self.gas_spec[i]))
+
+        GasList = ['gas_energies', 'gas_molec_weights', 'gas_molar_fracs']
+        GasList2 = ['gas_eng', 'gas_MW', 'gas_molfrac']
+        for j in range(0, len(GasList)):
+            out.append('\n{:20}'.format(GasList[j]))
             for i in range(0, self.n_gas):
-                txt.write('{:15}'.format(self.gas_spec[i]))
-
-            GasList = ['gas_energies', 'gas_molec_weights', 'gas_molar_fracs']
-            GasList2 = ['gas_eng', 'gas_MW', 'gas_molfrac']
-            for j in range(0, len(GasList)):
-                txt.write('\n{:20}'.format(GasList[j]))
-                for i in range(0, self.n_gas):
-                    txt.write('{:15}'.format(str(getattr(self,
-                              GasList2[j])[i])))
-
-            txt.write('\n\n{:20}{}\n'.format('n_surf_species',
-                      str(self.n_surf)))
-            txt.write('{:20}'.format('surf_specs_names'))
-            for i in range(0, self.n_surf):
-                txt.write('{:15}'.format(self.surf_spec[i]))
-            txt.write('\n{:20}'.format('surf_specs_dent'))
-
-            for i in range(0, self.n_surf):
-                txt.write('{:15}'.format(str(self.surf_dent[i])))
-            txt.write('\n\n')
-
-            if self.hist is None:
-                txt.write('{:20}{}\n'.format('snapshots', 'off'))
-            elif self.hist[0] == 'event':
-                txt.write('{:20}{} {} {}\n'.format('snapshots', 'on',
-                          self.hist[0],
-                          str(int(self.hist[1]))))
-            elif self.hist[0] == 'time':
-                txt.write('{:20}{} {} {}\n'.format('snapshots', 'on',
-                          self.hist[0],
-                          str(np.float(self.hist[1]))))
-                          
-            if self.procstat[0] == 'off':
-                txt.write('process_statistics  off\n')
-            elif self.procstat[0] == 'event':
-                txt.write('{:20}{} {} {}\n'.format('process_statistics', 'on',
-                          self.procstat[0],
-                          str(int(self.procstat[1]))))
-            elif self.procstat[0] == 'time':
-                txt.write('{:20}{} {} {}\n'.format('process_statistics', 'on',
-                          self.procstat[0],
-                          str(np.float(self.procstat[1]))))
-
-            if self.specnum[0] == 'off':
-                txt.write('species_numbers     off\n')
-            elif self.specnum[0] == 'event':
-                txt.write('{:20}{} {} {}\n'.format('species_numbers', 'on',
-                          self.specnum[0],
-                          str(int(self.specnum[1]))))
-            elif self.specnum[0] == 'time':
-                txt.write('{:20}{} {} {}\n'.format('species_numbers', 'on',
-                          self.specnum[0],
-                          str(np.float(self.specnum[1]))))
-            txt.write('{:20}{}\n\n'.format('event_report',
-                      self.event))
-
-            if self.MaxStep is None or\
-               _re.search('inf', str(self.MaxStep)):
-                txt.write('{:20}{}\n'.format('max_steps', 'infinity'))
-            else:
-                txt.write('{:20}{}\n'.format('max_steps',
-                          str(self.MaxStep)))
+                out.append('{:15}'.format(str(getattr(self,
+                          GasList2[j])[i])))
+
+        out.append('\n\n{:20}{}\n'.format('n_surf_species',
+                  str(self.n_surf)))
+        out.append('{:20}'.format('surf_specs_names'))
+        for i in range(0, self.n_surf):
+            out.append('{:15}'.format(self.surf_spec[i]))
+        out.append('\n{:20}'.format('surf_specs_dent'))
+
+        for i in range(0, self.n_surf):
+            out.append('{:15}'.format(str(self.surf_dent[i])))
+        out.append('\n\n')
+
+        if self.hist is None:
+            out.append('{:20}{}\n'.format('snapshots', 'off'))
+        elif self.hist[0] == 'event':
+            out.append('{:20}{} {} {}\n'.format('snapshots', 'on',
+                      self.hist[0],
+                      str(int(self.hist[1]))))
+        elif self.hist[0] == 'time':
+            out.append('{:20}{} {} {}\n'.format('snapshots', 'on',
+                      self.hist[0],
+                      str(np.float(self.hist[1]))))
+                      
+        if self.procstat[0] == 'off':
+            out.append('process_statistics  off\n')
+        elif self.procstat[0] == 'event':
+            out.append('{:20}{} {} {}\n'.format('process_statistics', 'on',
+                      self.procstat[0],
+                      str(int(self.procstat[1]))))
+        elif self.procstat[0] == 'time':
+            out.append('{:20}{} {} {}\n'.format('process_statistics', 'on',
+                      self.procstat[0],
+                      str(np.float(self.procstat[1]))))
+
+        if self.specnum[0] == 'off':
+            out.append('species_numbers     off\n')
+        elif self.specnum[0] == 'event':
+            out.append('{:20}{} {} {}\n'.format('species_numbers', 'on',
+                      self.specnum[0],
+                      str(int(self.specnum[1]))))
+        elif self.specnum[0] == 'time':
+            out.append('{:20}{} {} {}\n'.format('species_numbers', 'on',
+                      self.specnum[0],
+                      str(np.float(self.specnum[1]))))
+        out.append('{:20}{}\n\n'.format('event_report',
+                  self.event))
+
+        if self.MaxStep is None or\
+           _re.search('inf', str(self.MaxStep)):
+            out.append('{:20}{}\n'.format('max_steps', 'infinity'))
+        else:
+            out.append('{:20}{}\n'.format('max_steps',
+                      str(self.MaxStep)))
 
-            if self.SimTime_Max is None or\
-               _re.search('inf', str(self.SimTime_Max)):
-                txt.write('{:20}{}\n'.format('max_time', 'infinity\n'))
-            else:
-                txt.write('{:20}{}\n'.format('max_time',
-                          str(self.SimTime_Max)))
-            if self.WallTime_Max is None or\
-               _re.search('inf', str(self.WallTime_Max)):
-                txt.write('\n')
-            else:
-                txt.write('\n{:20}{}\n\n'.format('wall_time',
-                          str(self.WallTime_Max)))
+        if self.SimTime_Max is None or\
+           _re.search('inf', str(self.SimTime_Max)):
+            out.append('{:20}{}\n'.format('max_time', 'infinity\n'))
+        else:
+            out.append('{:20}{}\n'.format('max_time',
+                      str(self.SimTime_Max)))
+        if self.WallTime_Max is None or\
+           _re.search('inf', str(self.WallTime_Max)):
+            out.append('\n')
+        else:
+            out.append('\n{:20}{}\n\n'.format('wall_time',
+                      str(self.WallTime_Max)))
 
-            if not self.restart:
-                txt.write('no_restart\n')
-            txt.write('finish\n')
+        if not self.restart:
+            out.append('no_restart\n')
+        out.append('finish\n')
+        
+        return ''.join(out)
             
 
 
@@ -339,82 +364,54 @@ class ClusterIn(object):
         '''
         
         RawTxt = _ReadWithoutBlankLines(os.path.join(fldr, self.fname), CommentLines=False)
-        nLines = len(RawTxt)
-    
-        nClusters = 0
-        for i in range(0, nLines):
-            if RawTxt[i].split()[0] == 'cluster':
-                nClusters += 1
-    
-        ClusterInd = np.array([ [0, 0] ] * nClusters)
-        Count = 0
-        for i in range(0, nLines):
-            if RawTxt[i].split()[0] == 'cluster':
-                ClusterInd[Count, 0] = i
-            if RawTxt[i].split()[0] == 'end_cluster':
-                ClusterInd[Count, 1] = i
-                Count += 1
-    
-        nClusterTotal = 0
-        self.cluster_list = [Cluster() for j in range(nClusters)]
-        
-        # Loop through all clusters
-        for j in range(nClusters):
-        
-            self.cluster_list[j].name = RawTxt[ClusterInd[j, 0]].split()[1]
-            n_variants = 0
-            
-            for i in range(ClusterInd[j, 0] + 1, ClusterInd[j, 1]):
-                if RawTxt[i].split()[0] == 'variant':
-                    n_variants += 1
-                elif RawTxt[i].split()[0] == 'sites':
-                    self.cluster_list[j].sites = int(RawTxt[i].split()[1])
-                elif RawTxt[i].split()[0] == 'neighboring':
-                    self.cluster_list[j].neighboring = RawTxt[i].split()[1:]
-                elif RawTxt[i].split()[0] == 'lattice_state':
-                    self.cluster_list[j].latstate = RawTxt[i + 1:i + 1 +
-                                                    self.cluster_list[j].sites]
-                    for k in range(0, len(self.cluster_list[j].latstate)):
-                        self.cluster_list[j].latstate[k] =\
-                        self.cluster_list[j].latstate[k].split('\n')[0]
-    
-            nClusterTotal += n_variants
-            
-            # Find beginning and ending lines for each variant
+        
+        # Read the file in one pass, keeping track of the current cluster and variant
+        self.cluster_list = []
+        clustr = None
+        varnt = None
+        implicit_varnt = None       # used if a cluster has no variant blocks
+        
+        for i, line in enumerate(RawTxt):
+        
+            words = line.split()
             
-            if n_variants == 0:
+            if words[0] == 'cluster':
+                clustr = Cluster()
+                clustr.name = words[1]
+                self.cluster_list.append(clustr)
+                varnt = None
+                implicit_varnt = cluster_variant()
+                continue
+            elif clustr is None:
+                continue
             
-                n_variants = 1
-                variantInd = np.array([[0, 0]]*n_variants)
-                variantInd[0, 0] = ClusterInd[j, 0] + 1
-                variantInd[0, 1] = ClusterInd[j, 1]
+            # Cluster information
+            if words[0] == 'end_cluster':
+                if len(clustr.variant_list) == 0:
+                    clustr.variant_list = [implicit_varnt]
+                clustr = None
+            elif words[0] == 'variant':
+                varnt = cluster_variant()
+                varnt.name = words[1]
+                clustr.variant_list.append(varnt)
+            elif words[0] == 'end_variant':
+                varnt = None
+            elif words[0] == 'sites':
+                clustr.sites = int(words[1])
+            elif words[0] == 'neighboring':
+                clustr.neighboring = words[1:]
+            elif words[0] == 'lattice_state':
+                clustr.latstate = [state.split('\n')[0] for state in RawTxt[i + 1:i + 1 + clustr.sites]]
                 
+            # Variant information
             else:
-            
-                variantInd = np.array([[0, 0]]*n_variants)
-                Count = 0
-                for i in range(ClusterInd[j, 0]+1, ClusterInd[j, 1]):
-                    if RawTxt[i].split()[0] == 'variant':
-                        variantInd[Count, 0] = i
-                    if RawTxt[i].split()[0] == 'end_variant':
-                        variantInd[Count, 1] = i
-                        Count += 1
-                    
-            self.cluster_list[j].variant_list = [cluster_variant() for k in range(n_variants)]
-
-            # Loop through all variants for this cluster
-            for k in range(n_variants):
-            
-                for i in range(variantInd[k, 0], variantInd[k, 1]):
-                
-                    if RawTxt[i].split()[0] == 'variant':
-                        self.cluster_list[j].variant_list[k].name = RawTxt[i].split()[1]
-                    elif RawTxt[i].split()[0] == 'site_types':
-                        self.cluster_list[j].variant_list[k].site_types = RawTxt[i].split()[1:]
-                    elif RawTxt[i].split()[0] == 'graph_multiplicity':
-                        self.cluster_list[j].variant_list[k].graph_multiplicity = int(RawTxt[i].split()[1])
-                    elif RawTxt[i].split()[0] == 'cluster_eng':
-                        self.cluster_list[j].variant_list[k].cluster_eng = float(RawTxt[i].split()[1])
+                cur_varnt = implicit_varnt if varnt is None else varnt
+                if words[0] == 'site_types':
+                    cur_varnt.site_types = words[1:]
+                elif words[0] == 'graph_multiplicity':
+                    cur_varnt.graph_multiplicity = int(words[1])
+                elif words[0] == 'cluster_eng':
+                    cur_varnt.cluster_eng = float(words[1])
      
                         
     def WriteIn(self, fldr):
@@ -566,135 +563,80 @@ class MechanismIn(object):
         '''
         
         RawTxt = _ReadWithoutBlankLines(os.path.join(fldr, self.fname), CommentLines=True)
-        nLines = len(RawTxt)
         StiffCorrLine = -1
-    
+        
+        # Read the file in one pass, keeping track of the current reaction and variant
         self.rxn_list = []
-        n_rxns = 0
-        for i in range(nLines):
-            if RawTxt[i].split()[0] == 'reversible_step':
-                self.rxn_list.append( Reaction() )
-                n_rxns += 1
-            elif RawTxt[i].split()[0] == 'step':
-                self.rxn_list.append( Reaction() )
-                self.rxn_list[-1].is_reversible = False
-                n_rxns += 1
-            elif _re.search('# Automated stiffness reconditioning employed',
-                            RawTxt[i]):
-                StiffCorrLine = i
-                self.include_scaledown = True
-    
-        if StiffCorrLine != -1:
-            scaledown_factor_list = [np.float(i) for i in RawTxt[StiffCorrLine+2].split(':')[1].split()]
-    
-        # Identify which lines of text are for each reaction
-        MechInd = np.array([[0, 0]]*n_rxns)
-        Count = 0
-        for i in range(nLines):
-    
-            if RawTxt[i].split()[0] == 'reversible_step' or RawTxt[i].split()[0] == 'step':
-                MechInd[Count, 0] = i
-    
-            elif RawTxt[i].split()[0] == 'end_reversible_step':
-                MechInd[Count, 1] = i
-                Count += 1
-    
-            elif RawTxt[i].split()[0] == 'end_step':
-                MechInd[Count, 1] = i
-                Count += 1
-        
-        all_rxn_ind = 0     # Use this index to assign scaledown factors
-        
-        # Loop over list of recations
-        for j in range(n_rxns):
-    
-            # Count the variants
-    
-            self.rxn_list[j].name = RawTxt[MechInd[j, 0]].split()[1]
-            n_variants = 0
-            InVariant = False
-            StateLine = []
-            for i in range(MechInd[j, 0] + 1, MechInd[j, 1]):
-                if RawTxt[i].split()[0] == 'variant':
-                    n_variants += 1
-                    InVariant = True
-                elif RawTxt[i].split()[0] == 'end_variant':
-                    InVariant = False
-                elif RawTxt[i].split()[0] == 'gas_reacs_prods':
-                    self.rxn_list[j].gas_reacs_prods = RawTxt[i].split()[1:]
-                elif RawTxt[i].split()[0] == 'sites':
-                    nSites = int(RawTxt[i].split()[1])
-                    self.rxn_list[j].sites = nSites
-                elif RawTxt[i].split()[0] == 'neighboring':
-                    self.rxn_list[j].neighboring = RawTxt[i].split()[1:]
-                elif RawTxt[i].split()[0] == 'initial':
-                    self.rxn_list[j].initial = []
-                    LatState = RawTxt[i+1:i+1+nSites]
-                    for k in range(0, len(LatState)):
-                            self.rxn_list[j].initial.\
-                            append(LatState[k].split('\n')[0])
-                    for k in range(0, nSites):
-                        StateLine.append(i+1+k)
-                elif RawTxt[i].split()[0] == 'final':
-                    self.rxn_list[j].final = []
-                    LatState = RawTxt[i + 1:i + 1 + nSites]
-                    for k in range(0, len(LatState)):
-                            self.rxn_list[j].final.\
-                            append(LatState[k].split('\n')[0])
-                    for k in range(0, nSites):
-                        StateLine.append(i+1+k)
-
-            if n_variants == 0:     # There are no variants, just one version of the reaction
+        rxn = None
+        varnt = None
+        implicit_varnt = None       # used if a reaction has no variant blocks
+        
+        for i, line in enumerate(RawTxt):
+        
+            words = line.split()
             
-                #raise NameError('No variants for reaction: ' + self.rxn_list[j].name)
-                n_variants = 1
+            if words[0] == 'reversible_step' or words[0] == 'step':
+                rxn = Reaction()
+                rxn.is_reversible = (words[0] == 'reversible_step')
+                rxn.name = words[1]
+                self.rxn_list.append(rxn)
+                varnt = None
+                implicit_varnt = rxn_variant()
+                continue
+            elif rxn is None:
+                if '# Automated stiffness reconditioning employed' in line:
+                    StiffCorrLine = i
+                    self.include_scaledown = True
+                continue
                 
-                # Find the beginning and end of the reaction information
-                variantInd = np.array([[0, 0]]*n_variants)
-                variantInd[0, 0] = MechInd[j, 0] + 1 
-                variantInd[0, 1] = MechInd[j, 1]
+            # Reaction information
+            if words[0] == 'end_reversible_step' or words[0] == 'end_step':
+                if len(rxn.variant_list) == 0:     # There are no variants, just one version of the reaction
+                    rxn.variant_list = [implicit_varnt]
+                rxn = None
+            elif words[0] == 'variant':
+                varnt = rxn_variant()
+                varnt.name = words[1]
+                rxn.variant_list.append(varnt)
+            elif words[0] == 'end_variant':
+                varnt = None
+            elif words[0] == 'gas_reacs_prods':
+                rxn.gas_reacs_prods = words[1:]
+            elif words[0] == 'sites':
+                nSites = int(words[1])
+                rxn.sites = nSites
+            elif words[0] == 'neighboring':
+                rxn.neighboring = words[1:]
+            elif words[0] == 'initial':
+                rxn.initial = [state.split('\n')[0] for state in RawTxt[i + 1:i + 1 + nSites]]
+            elif words[0] == 'final':
+                rxn.final = [state.split('\n')[0] for state in RawTxt[i + 1:i + 1 + nSites]]
                 
+            # Variant information
             else:
-                    
-                # Find beginning and ending lines for each variant
-                variantInd = np.array([[0, 0]]*n_variants)
-                Count  = 0
-                for i in range(MechInd[j, 0] + 1, MechInd[j, 1]):
-                    if RawTxt[i].split()[0] == 'variant':
-                        variantInd[Count, 0] = i
-                    if RawTxt[i].split()[0] == 'end_variant':
-                        variantInd[Count, 1] = i
-                        Count += 1
-
-            self.rxn_list[j].variant_list = [ rxn_variant() for i in range(n_variants) ]
-                    
-            # Loop over list of recation variants        
-            for k in range( n_variants ):
-            
-                for i in range(variantInd[k, 0], variantInd[k, 1]):
-                    if RawTxt[i].split()[0] == 'variant':
-                        self.rxn_list[j].variant_list[k].name = RawTxt[i].split()[1]
-                    elif RawTxt[i].split()[0] == 'site_types':
-                        self.rxn_list[j].variant_list[k].site_types = RawTxt[i].split()[1:]
-                    elif RawTxt[i].split()[0] == 'pre_expon':
-                        self.rxn_list[j].variant_list[k].pre_expon = float(RawTxt[i].split()[1])
-                    elif RawTxt[i].split()[0] == 'pe_ratio':
-                        self.rxn_list[j].variant_list[k].pe_ratio = float(RawTxt[i].split()[1])
-                    elif RawTxt[i].split()[0] == 'activ_eng':
-                        self.rxn_list[j].variant_list[k].activ_eng = float(RawTxt[i].split()[1])
-                    elif RawTxt[i].split()[0] == 'prox_factor':
-                        self.rxn_list[j].variant_list[k].prox_factor = float(RawTxt[i].split()[1])
-                    elif RawTxt[i].split()[0] == '#':
-                        pass
-                
-                # If there is no variant, it does not have an extra name
-                if self.rxn_list[j].variant_list[k].name is None:
-                    self.rxn_list[j].variant_list[k].name = ''
-                
-                # Assign scaledown factor if it is present
-                if StiffCorrLine != -1:
-                    self.rxn_list[j].variant_list[k].scaledown_factor = scaledown_factor_list[all_rxn_ind]
-                all_rxn_ind += 1
+                cur_varnt = implicit_varnt if varnt is None else varnt
+                if words[0] == 'site_types':
+                    cur_varnt.site_types = words[1:]
+                elif words[0] == 'pre_expon':
+                    cur_varnt.pre_expon = float(words[1])
+                elif words[0] == 'pe_ratio':
+                    cur_varnt.pe_ratio = float(words[1])
+                elif words[0] == 'activ_eng':
+                    cur_varnt.activ_eng = float(words[1])
+                elif words[0] == 'prox_factor':
+                    cur_varnt.prox_factor = float(words[1])
+                elif '# Automated stiffness reconditioning employed' in line:
+                    StiffCorrLine = i
+                    self.include_scaledown = True
+    
+        # Assign scaledown factors if they are present, in the order of the reaction variants
+        if StiffCorrLine != -1:
+            scaledown_factor_list = [np.float(i) for i in RawTxt[StiffCorrLine+2].split(':')[1].split()]
+            all_rxn_ind = 0
+            for rxn in self.rxn_list:
+                for varnt in rxn.variant_list:
+                    varnt.scaledown_factor = scaledown_factor_list[all_rxn_ind]
+                    all_rxn_ind += 1
 
 
     def WriteIn(self, fldr):
@@ -1055,19 +997,25 @@ class StateIn(object):
 
         elif self.Type == 'history':
 
-            Lattice = self.Struct
+            Lattice = np.asarray(self.Struct)
             UniqSpec = np.unique(Lattice[np.not_equal(
                     Lattice[:, 2], 0), 1])
             nAds = len(UniqSpec)
-            SpecIden = [0] * nAds
-            AdsInfo = [[] for i in range(0, nAds)]
-            DentInfo = [[] for i in range(0, nAds)]
-            for i in range(0, nAds):
-                for j in range(0, Lattice.shape[0]):
-                    if UniqSpec[i] == Lattice[j, 1]:
-                        AdsInfo[i].append(j + 1)
-                        DentInfo[i].append(Lattice[j, 3])
-                        SpecIden[i] = Lattice[j, 2]
+            
+            # Sites of each adsorbate, sorted by dentate and then by site
+            rows = np.nonzero(np.in1d(Lattice[:, 1], UniqSpec))[0]
+            rows = rows[np.lexsort((rows, Lattice[rows, 3], Lattice[rows, 1]))]
+            ads_start = np.searchsorted(Lattice[rows, 1], UniqSpec)
+            n_rows = np.diff(np.append(ads_start, len(rows)))
+            
+            # The species is taken from the last site of each adsorbate
+            SpecIden = Lattice[np.maximum.reduceat(rows, ads_start), 2] if nAds > 0 else []
+            
+            # Dentates 1 to the number of sites of the adsorbate are written
+            dent = Lattice[rows, 3]
+            keep = (dent >= 1) & (dent <= np.repeat(n_rows, n_rows))
+            site_txt = [str(j + 1) + '  ' for j in rows[keep]]
+            site_start = np.searchsorted(np.nonzero(keep)[0], np.append(ads_start, len(rows)))
 
             if nAds > 0:
                 with open(os.path.join(fldr, self.fname), 'w') as txt:
@@ -1076,10 +1024,7 @@ class StateIn(object):
                         txt.write('  seed_on_sites  {:10}'.
                                   format(surf_spec
                                          [SpecIden[i]-1], 10))
-                        for j in range(0, len(DentInfo[i])):
-                            for k in range(0, len(DentInfo[i])):
-                                if j + 1 == DentInfo[i][k]:
-                                    txt.write(str(AdsInfo[i][k]) + '  ')
+                        txt.write(''.join(site_txt[site_start[i]:site_start[i+1]]))
                         txt.write('\n')
                     txt.write('end_initial_state\n')
         else:
@@ -1110,9 +1055,12 @@ class PerformanceOut(object):
         self.UniqNu = None
         
     
-    def ReadOut(self, fldr, surf_spec_names, gas_spec_names):
+    def ReadOut(self, fldr, surf_spec_names, gas_spec_names, read_network = True):
         '''
         Read general_output.txt
+        
+        :param read_network: True - parse the reaction names and stoichiometries in the reaction network
+            False - keep the ones already read, e.g. from another trajectory with the same mechanism
         '''
         
         n_surf = len(surf_spec_names)
@@ -1122,60 +1070,52 @@ class PerformanceOut(object):
             RawTxt = txt.readlines()
     
         for i in range(0, len(RawTxt)):
-            if _re.search('Number of elementary steps:', RawTxt[i]):
+            if 'Number of elementary steps:' in RawTxt[i]:
                 self.nRxn = np.int(RawTxt[i].split(':')[1])
-            elif _re.search('Current KMC time:', RawTxt[i]):
+            elif 'Current KMC time:' in RawTxt[i]:
                 self.t_final = np.float(RawTxt[i].split(':')[1])
-            elif _re.search('Events occurred:', RawTxt[i]):
+            elif 'Events occurred:' in RawTxt[i]:
                 self.events_occurred =\
                 np.float(RawTxt[i].split(':')[1])
-            elif _re.search('Elapsed CPU time:', RawTxt[i]):
+            elif 'Elapsed CPU time:' in RawTxt[i]:
                 after_colon = RawTxt[i].split(':')[1]
                 self.CPU_time =\
                     np.float(after_colon.split(' ')[-2])
-            elif _re.search('Reaction network:', RawTxt[i]):
+            elif 'Reaction network:' in RawTxt[i]:
                 RxnStartLine = i + 2
+                
+        if not read_network:
+            return
     
         if RawTxt[RxnStartLine].split()[0] == '1.':
             NameInd = 1
         else:
             NameInd = 0
+            
+        # Column of each species in the stoichiometry matrix
+        surf_ind = {name: k for k, name in enumerate(surf_spec_names)}
+        gas_ind = {name: n_surf + k for k, name in enumerate(gas_spec_names)}
+        
+        # Remove site labels, e.g. A(1) -> A
+        site_label = _re.compile(r'\([^)]*\)')
     
         self.RxnNameList = []
-        nuList = []
-        for i in range(RxnStartLine, RxnStartLine + self.nRxn):
-            RxnName = RawTxt[i].split()[NameInd][:-1]
-            self.RxnNameList.append(RxnName)
-            RxnStr = RawTxt[i][_re.search('Reaction:', RawTxt[i]).end():]
-            RxnStrList = RxnStr.split()
-            nu = [0] * (n_surf + n_gas)
-            for j in range(0, len(RxnStrList)):
-                if RxnStrList[j] == '->':
-                    ArrowInd = j
-            for j in range(0, len(RxnStrList)):
-                if j < ArrowInd:
-                    Sign = -1
-                else:
-                    Sign = 1
-    
-                if _re.search('\(', RxnStrList[j]):
-                    SurfIden = _re.sub(r'\([^)]*\)', '', RxnStrList[j])
+        self.Nu = np.zeros([self.nRxn, n_surf + n_gas], dtype = np.int)
+        for i in range(self.nRxn):
+            line = RawTxt[RxnStartLine + i]
+            self.RxnNameList.append(line.split()[NameInd][:-1])
+            RxnStrList = line[line.index('Reaction:') + len('Reaction:'):].split()
+            ArrowInd = len(RxnStrList) - 1 - RxnStrList[::-1].index('->')
+            for j, token in enumerate(RxnStrList):
+                Sign = -1 if j < ArrowInd else 1
+                if '(' in token:
+                    SurfIden = site_label.sub('', token)
                     if SurfIden != '*':
-                        SurfInd = [k for k in
-                                range( n_surf )
-                                if SurfIden ==
-                                surf_spec_names[k]][0]
-                        nu[SurfInd] += Sign
-                elif RxnStrList[j] != '->' and RxnStrList[j] != '+':
-                    GasInd = [k for k in
-                            range( n_gas )
-                            if RxnStrList[j] ==
-                            gas_spec_names[k]][0]
-                    nu[ n_surf + GasInd] += Sign
-            nuList.append(nu)
-    
-        self.Nu = nuList
-        self.UniqNu = _ReturnUnique(nuList).tolist()
+                        self.Nu[i, surf_ind[SurfIden]] += Sign
+                elif token != '->' and token != '+':
+                    self.Nu[i, gas_ind[token]] += Sign
+    
+        self.UniqNu = _ReturnUnique(self.Nu).tolist()
 
 
 class ProcstatOut(object):
@@ -1191,38 +1131,105 @@ class ProcstatOut(object):
         self.Spacing = None
         self.t = None
         self.events = None
+        self.file_pos = 0               # bytes of the file read by ReadNew
     
-    def ReadOut(self, fldr):
+    def ReadOut(self, fldr, max_samples = 20000, t_grid = None):
         '''
         Read procstat_output.txt
+        
+        :param fldr: Folder containing the file
+        
+        :param max_samples: Maximum number of records to keep. Longer files are decimated while
+            they are read, so memory use is set by the output arrays rather than the file size.
+            Use None to keep every record.
+            
+        :param t_grid: Times at which to sample the event counts, instead of decimating by max_samples.
+            Each time takes the last record at or before it.
         '''
-        MaxLen = np.int(2e4)
-        with open(os.path.join(fldr, self.fname), 'r') as txt:
-            RawTxt = txt.readlines()
-
-        if len(RawTxt) - 1 > MaxLen * 3:  # Procstat uses 3 lines per outputs
-            Spacing = np.int(np.floor((len(RawTxt) - 1)/(MaxLen*3)))
-            RawTxt2 = []
-            for i in range(0, MaxLen):
-                RawTxt2.append(RawTxt[i*Spacing*3+1])
-                RawTxt2.append(RawTxt[i*Spacing*3+2])
-                RawTxt2.append(RawTxt[i*Spacing*3+3])
+        
+        fpath = os.path.join(fldr, self.fname)
+        
+        if not t_grid is None:
+        
+            def record_blocks(txt, ncols, chunk_size = 10000):
+                records = _izip(txt, txt, txt)
+                while True:
+                    chunk = list(_islice(records, chunk_size))
+                    t = np.array([np.float(rec[0].split()[3]) for rec in chunk])
+                    yield t, _read_numeric_block((rec[2] for rec in chunk), ncols, dtype = np.int64)
+                    if len(chunk) < chunk_size:
+                        break
+                    
+            with open(fpath, 'r') as txt:
+                ncols = len(txt.readline().split())
+                events, rec_ind = _step_sample(record_blocks(txt, ncols), t_grid, ncols, dtype = np.int64)
+                
+            self.Spacing = None
+            self.t = np.array(t_grid, dtype = np.float64)[:events.shape[0]]
+            self.events = events[:, 1:]
+            return
+        
+        nRec = np.max([(_rawbigcount(fpath) - 1) // 3, 0])       # Procstat uses 3 lines per output
+        
+        if max_samples is not None and nRec > max_samples:
+            Spacing = nRec // max_samples
+            nKeep = max_samples
         else:
             Spacing = 1
-            RawTxt2 = RawTxt[1:]
+            nKeep = nRec
 
-        t = []
-        events = []
-        for i in range(0, len(RawTxt2)/3):
-            t.append(np.float(RawTxt2[i*3].split()[3]))
-            eventsTemp = RawTxt2[i*3+2].split()[1:]
-            for j in range(0, len(eventsTemp)):
-                eventsTemp[j] = np.int(eventsTemp[j])
-            events.append(eventsTemp)
+        t = np.zeros(nKeep)
+        
+        def event_lines(records):       # record the time of each kept record as it streams past
+            for i, rec in enumerate(records):
+                t[i] = np.float(rec[0].split()[3])
+                yield rec[2]
+        
+        with open(fpath, 'r') as txt:
+            ncols = len(txt.readline().split())
+            records = _islice(_izip(txt, txt, txt), 0, Spacing * nKeep, Spacing)
+            events = _read_numeric_block(event_lines(records), ncols, nrows = nKeep, dtype = np.int64)
 
         self.Spacing = Spacing
-        self.t = np.asarray(t)
-        self.events = np.asarray(events)
+        self.t = t[:events.shape[0]]
+        self.events = events[:, 1:]
+        
+    def ReadNew(self, fldr):
+        '''
+        Append the records written to procstat_output.txt since the last call. Only complete
+        records are read, so this can follow the file of a running simulation.
+        
+        :param fldr: Folder containing the file
+        
+        :returns: Number of new records
+        '''
+        
+        with open(os.path.join(fldr, self.fname), 'rb') as txt:
+            txt.seek(self.file_pos)
+            new_txt = txt.read()
+            
+        lines = new_txt.split(b'\n')[:-1]          # the last entry is an incomplete line or empty
+        start = 0
+        if self.file_pos == 0:
+            if len(lines) == 0:
+                return 0
+            start = 1               # header
+            self.Spacing = 1
+            self.t = np.zeros(0)
+            self.events = np.zeros([0, len(lines[0].split()) - 1], dtype = np.int64)
+        
+        nNew = (len(lines) - start) // 3
+        lines = lines[:start + 3 * nNew]
+        
+        if nNew > 0:
+            records = lines[start:]
+            t_new = np.array([np.float(line.split()[3]) for line in records[0::3]])
+            events_new = np.fromstring(b' '.join(records[2::3]), dtype = np.int64, sep = ' ').reshape([nNew, -1])
+            self.t = np.concatenate([self.t, t_new])
+            self.events = np.concatenate([self.events, events_new[:, 1:]])
+            
+        self.file_pos += sum(len(line) + 1 for line in lines)
+        return nNew
 
 
 class SpecnumOut(object):
@@ -1245,49 +1252,135 @@ class SpecnumOut(object):
         self.T = None
         self.E = None
         self.spec = None
+        self.rec_ind = None             # index of the record in the file for each row
+        self.file_pos = 0               # bytes of the file read by ReadNew
         
     
-    def ReadOut(self, fldr):
+    def ReadOut(self, fldr, max_samples = 20000, t_grid = None):
         '''
         Read specnum_output.txt
+        
+        :param fldr: Folder containing the file
+        
+        :param max_samples: Maximum number of records to keep. Longer files are decimated while
+            they are read, so memory use is set by the output arrays rather than the file size.
+            Use None to keep every record.
+            
+        :param t_grid: Times at which to sample the species numbers, instead of decimating by max_samples.
+            Each time takes the last record at or before it. The indices of these records are kept in
+            rec_ind so that the binary outputs can be sampled the same way.
         '''
-        MaxLen = np.int(2e4)
-        with open(os.path.join(fldr, self.fname), 'r') as txt:
-            RawTxt = txt.readlines()
-
-        if len(RawTxt) - 1 > MaxLen:
-            Spacing = np.int(np.floor((len(RawTxt)-1)/MaxLen))
-            RawTxt2 = []
-            for i in range(0, MaxLen):
-                RawTxt2.append(RawTxt[i*Spacing+1])
+        
+        fpath = os.path.join(fldr, self.fname)
+        
+        if t_grid is None:
+        
+            nRec = np.max([_rawbigcount(fpath) - 1, 0])
+            
+            if max_samples is not None and nRec > max_samples:
+                Spacing = nRec // max_samples
+                nKeep = max_samples
+            else:
+                Spacing = 1
+                nKeep = nRec
+    
+            with open(fpath, 'r') as txt:
+                ncols = len(txt.readline().split())
+                data = _read_numeric_block(_islice(txt, 0, Spacing * nKeep, Spacing), ncols, nrows = nKeep)
+            
+            rec_ind = np.arange(0, Spacing * nKeep, Spacing)[:data.shape[0]]
+            
         else:
-            Spacing = 1
-            RawTxt2 = RawTxt[1:]
-
-        nEvents = []
-        t = []
-        T = []
-        E = []
-        spec = []
-
-        for i in range(0, len(RawTxt2)):
-            LineSplit = RawTxt2[i].split()
-            nEvents.append(np.int(LineSplit[1]))
-            t.append(np.float(LineSplit[2]))
-            T.append(np.float(LineSplit[3]))
-            E.append(np.float(LineSplit[4]))
-            specTemp = LineSplit[5:]
-            for j in range(0, len(specTemp)):
-                specTemp[j] = np.int(specTemp[j])
-            spec.append(specTemp)
+        
+            def record_blocks(txt, ncols, chunk_size = 10000):
+                while True:
+                    block = _read_numeric_block(_islice(txt, chunk_size), ncols)
+                    yield block[:, 2], block
+                    if block.shape[0] < chunk_size:
+                        break
+                        
+            with open(fpath, 'r') as txt:
+                ncols = len(txt.readline().split())
+                data, rec_ind = _step_sample(record_blocks(txt, ncols), t_grid, ncols)
+            data[:, 2] = np.array(t_grid, dtype = np.float64)[:data.shape[0]]
+            Spacing = None
             
         # Store data in class variables
         self.Spacing = Spacing
-        self.nEvents = np.asarray(nEvents)
-        self.t = np.asarray(t)
-        self.T = np.asarray(T)
-        self.E = np.asarray(E)
-        self.spec = np.asarray(spec)
+        self.rec_ind = rec_ind
+        self.nEvents = data[:, 1].astype(np.int64)
+        self.t = np.array(data[:, 2])
+        self.T = np.array(data[:, 3])
+        self.E = np.array(data[:, 4])
+        self.spec = data[:, 5:].astype(np.int64)
+        
+    def ReadFinalTime(self, fldr):
+        '''
+        Read the time of the last record in specnum_output.txt without reading the rest of the file
+        
+        :param fldr: Folder containing the file
+        
+        :returns: Time of the last record, None if there are no records
+        '''
+        
+        with open(os.path.join(fldr, self.fname), 'rb') as txt:
+            txt.seek(0, 2)
+            file_size = txt.tell()
+            window = 4096
+            while True:
+                txt.seek(np.max([0, file_size - window]))
+                lines = txt.read().splitlines()
+                if window >= file_size or len(lines) > 2:       # the first line may be incomplete
+                    break
+                window *= 2
+        
+        lines = [line for line in lines if line.strip()]
+        if window >= file_size:
+            lines = lines[1:]           # header
+        if len(lines) == 0:
+            return None
+        return np.float(lines[-1].split()[2])
+    
+    
+    def ReadNew(self, fldr):
+        '''
+        Append the records written to specnum_output.txt since the last call. Only complete
+        lines are read, so this can follow the file of a running simulation.
+        
+        :param fldr: Folder containing the file
+        
+        :returns: Number of new records
+        '''
+        
+        with open(os.path.join(fldr, self.fname), 'rb') as txt:
+            txt.seek(self.file_pos)
+            new_txt = txt.read()
+        
+        end = new_txt.rfind(b'\n') + 1             # end of the last complete line
+        start = 0
+        if self.file_pos == 0:
+            if end == 0:
+                return 0
+            start = new_txt.index(b'\n') + 1       # header
+            ncols = len(new_txt[:start].split())
+            self.Spacing = 1
+            self.nEvents = np.zeros(0, dtype = np.int64)
+            self.t = np.zeros(0)
+            self.T = np.zeros(0)
+            self.E = np.zeros(0)
+            self.spec = np.zeros([0, ncols - 5], dtype = np.int64)
+        else:
+            ncols = self.spec.shape[1] + 5
+            
+        data = np.fromstring(new_txt[start:end], sep = ' ').reshape([-1, ncols])
+        
+        self.nEvents = np.concatenate([self.nEvents, data[:, 1].astype(np.int64)])
+        self.t = np.concatenate([self.t, data[:, 2]])
+        self.T = np.concatenate([self.T, data[:, 3]])
+        self.E = np.concatenate([self.E, data[:, 4]])
+        self.spec = np.concatenate([self.spec, data[:, 5:].astype(np.int64)])
+        self.file_pos += end
+        return data.shape[0]
     
 
 class HistoryOut():
@@ -1297,22 +1390,33 @@ class HistoryOut():
     '''
 
     fname = 'history_output.txt'
+    idx_fname = 'history_output.idx.npz'
+    idx_version = 1
     
     def __init__(self):
     
-        n_snapshots = 0
-        snapshots = []
-        snap_times = None
+        self.fldr = None
+        self.nSites = None
+        self.n_snapshots = 0
+        self.snapshots = []             # n_snapshots x nSites x 4 array: site, adsorbate, species, dentate
+        self.snap_times = None
+        self.snap_offsets = None        # byte offset of each configuration block
+        self.gas_counts = None          # gas species counts at each snapshot
+        self.final_snapshot = None      # last complete snapshot, used to continue a simulation
+        self.final_time = None
         
     def ReadOut(self, fldr, nSites):
     
         '''
-        Read history_output.txt
+        Read history_output.txt in a single pass
         fldr: name of the folder containting the file
         nSites: number of lattice sites, obtained from lattice_output.txt
         '''
         
         HistPath = os.path.join(fldr, self.fname)
+        self.__init__()
+        self.fldr = fldr
+        self.nSites = nSites
         
         # Check if file exists
         if not os.path.isfile(HistPath):
@@ -1320,21 +1424,284 @@ class HistoryOut():
 
         nLines = _rawbigcount(HistPath)
         
-        self.n_snapshots = (nLines-6)/(nSites+2)
-        self.snapshots = []
+        with open(HistPath, 'r') as txt:
+        
+            # Skip the header to reach the first configuration
+            n_header = 0
+            snap_header = ''
+            for line in txt:
+                if line.startswith('configuration'):
+                    snap_header = line
+                    break
+                n_header += 1
+            
+            self.n_snapshots = np.max([(nLines - n_header) // (nSites + 2), 0])
+            self.snapshots = np.zeros([self.n_snapshots, nSites, 4], dtype = np.int64)
+            self.snap_times = []
+            gas_counts = []
+            
+            for snap_ind in range(self.n_snapshots):
+                
+                if snap_ind > 0:
+                    snap_header = next(txt)
+                self.snap_times.append(snap_header.split()[3])
+                self.snapshots[snap_ind, :, :] = _read_numeric_block(_islice(txt, nSites), 4,
+                                                                     nrows = nSites, dtype = np.int64)
+                gas_counts.append([np.int(i) for i in next(txt).split()])
+        
+        self.gas_counts = np.array(gas_counts, dtype = np.int64)
+        if self.n_snapshots > 0:
+            self.final_snapshot = self.snapshots[-1]
+            self.final_time = self.snap_times[-1]
+        
+        
+    def ReadFinal(self, fldr, nSites):
+    
+        '''
+        Read only the last complete snapshot in history_output.txt by searching backwards from
+        the end of the file. The cost scales with the number of sites, not the number of snapshots.
+        Sets final_snapshot and final_time.
+        
+        :param fldr: Folder containing the file
+        
+        :param nSites: Number of lattice sites, obtained from lattice_output.txt
+        '''
+        
+        HistPath = os.path.join(fldr, self.fname)
+        self.__init__()
+        self.fldr = fldr
+        self.nSites = nSites
+        
+        if not os.path.isfile(HistPath):
+            return
+        
+        file_size = os.path.getsize(HistPath)
+        window = 100 * (nSites + 2)                   # about two snapshots
+        
+        with open(HistPath, 'r') as txt:
+        
+            while True:
+            
+                window = np.min([window, file_size])
+                txt.seek(file_size - window)
+                RawTxt = txt.read()
+                
+                # Start of each configuration block in the window, latest first
+                starts = [m.start() + 1 for m in _re.finditer('\nconfiguration', RawTxt)]
+                if window == file_size and RawTxt.startswith('configuration'):
+                    starts = [0] + starts
+                
+                for start in reversed(starts):
+                    SnapTxt = RawTxt[start:].splitlines(True)
+                    if len(SnapTxt) >= nSites + 2 and SnapTxt[nSites + 1].endswith('\n'):        # block has been completely written
+                        self.final_time = SnapTxt[0].split()[3]
+                        self.final_snapshot = _read_numeric_block(SnapTxt[1:nSites + 1], 4,
+                                                                  nrows = nSites, dtype = np.int64)
+                        return
+                        
+                if window == file_size:         # no complete snapshot in the file
+                    return
+                window = 2 * window
+        
+        
+    def ReadIndex(self, fldr, nSites):
+    
+        '''
+        Find where each snapshot starts in history_output.txt without reading the snapshots.
+        The byte offsets are saved in history_output.idx.npz and reused until the size or
+        modification time of history_output.txt changes.
+        
+        :param fldr: Folder containing the file
+        
+        :param nSites: Number of lattice sites, obtained from lattice_output.txt
+        '''
+        
+        HistPath = os.path.join(fldr, self.fname)
+        IdxPath = os.path.join(fldr, self.idx_fname)
+        self.fldr = fldr
+        self.nSites = nSites
+        self.snap_offsets = np.zeros(0, dtype = np.int64)
         self.snap_times = []
+        
+        if not os.path.isfile(HistPath):
+            return
+        
+        stats = os.stat(HistPath)
+        source = np.array([stats.st_size, stats.st_mtime, nSites, self.idx_version])
+        
+        # Use the saved index if it matches the current file
+        try:
+            with np.load(IdxPath) as idx:
+                if np.array_equal(idx['source'], source):
+                    self.snap_offsets = idx['offsets']
+                    self.snap_times = [str(i) for i in idx['times']]
+                    self.n_snapshots = len(self.snap_offsets)
+                    return
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+            
+        offsets = _line_offsets(HistPath, 'configuration')
+        
+        with open(HistPath, 'r') as txt:
+        
+            # Drop the last snapshot if it has not been completely written
+            if len(offsets) > 0:
+                txt.seek(offsets[-1])
+                if txt.read().count('\n') < nSites + 2:
+                    offsets = offsets[:-1]
+            
+            for offset in offsets:
+                txt.seek(offset)
+                self.snap_times.append(txt.readline().split()[3])
+                
+        self.snap_offsets = np.array(offsets, dtype = np.int64)
+        self.n_snapshots = len(offsets)
+        
+        try:
+            np.savez(IdxPath, source = source, offsets = self.snap_offsets, times = np.array(self.snap_times))
+        except (IOError, OSError):          # the index is only a convenience, e.g. the folder may be read-only
+            pass
+            
+    
+    def get_snapshot(self, snap_ind):
+    
+        '''
+        Get a single snapshot. If the snapshots have not been read into memory, seek directly to
+        it in history_output.txt using the snapshot index.
+        
+        :param snap_ind: Index of the snapshot
+        
+        :returns: nSites x 4 array with the site, adsorbate, species and dentate of each lattice site
+        '''
+        
+        if len(self.snapshots) == 0 and self.snap_offsets is None:
+            self.ReadIndex(self.fldr, self.nSites)
+            
+        snap_ind = range(self.n_snapshots)[snap_ind]         # also handles negative indices
+        for i, snap in self.iter_snapshots(start = snap_ind, stop = snap_ind + 1):
+            return snap
+        
+    
+    def iter_snapshots(self, start = 0, stop = None, stride = 1):
+    
+        '''
+        Iterate over snapshots, only reading the ones which are requested
+        
+        :param start: Index of the first snapshot
+        
+        :param stop: Index at which to stop. Defaults to the number of snapshots.
+        
+        :param stride: Step between snapshots
+        
+        :returns: Generator of (snapshot index, snapshot) pairs
+        '''
+        
+        if len(self.snapshots) > 0:         # already read into memory
+            for snap_ind in range(self.n_snapshots)[start:stop:stride]:
+                yield snap_ind, self.snapshots[snap_ind]
+            return
+            
+        if self.snap_offsets is None:
+            self.ReadIndex(self.fldr, self.nSites)
+        
+        with open(os.path.join(self.fldr, self.fname), 'r') as txt:
+            for snap_ind in range(self.n_snapshots)[start:stop:stride]:
+                txt.seek(self.snap_offsets[snap_ind])
+                txt.readline()
+                yield snap_ind, _read_numeric_block(_islice(txt, self.nSites), 4,
+                                                     nrows = self.nSites, dtype = np.int64)
+        
+
+def _read_numeric_block(lines, ncols, nrows = None, dtype = np.float64, chunk_size = 10000):
 
-        for snap_ind in range(self.n_snapshots):
-            snap_data = np.array([[0]*4]*nSites)
-            _linecache.clearcache()
-            snap_header = _linecache.getline(HistPath, 8 + snap_ind *
-                                             (nSites+2)-1).split()
-            self.snap_times.append(snap_header[3])
-            for i in range(0, nSites):
-                snap_data[i, :] = _linecache.getline(HistPath, 8 + snap_ind *
-                                                     (nSites+2)+i).split()
-            self.snapshots.append(snap_data)
+    '''
+    Parse whitespace-delimited numeric records into a 2-D array
+    
+    Lines are joined and converted chunk_size at a time with a single np.fromstring call,
+    so the memory used is the output array plus one chunk of text.
+    
+    :param lines: Iterable over the lines of the block, such as an open file
+    
+    :param ncols: Number of values in each record
+    
+    :param nrows: Expected number of records, used to preallocate the output. If None, read
+        until the lines are exhausted.
+    
+    :param dtype: Type used to parse the values. Integer columns parsed as float64 are exact below 2**53.
+    
+    :param chunk_size: Number of lines converted per call
+    
+    :returns: Array with one row per record
+    '''
+    
+    lines = iter(lines)
+    blocks = []
+    if not nrows is None:
+        data = np.zeros([nrows, ncols], dtype = dtype)
+    n_read = 0
+    
+    while True:
+    
+        chunk = ''.join(_islice(lines, chunk_size))
+        if chunk == '':
+            break
+        
+        block = np.fromstring(chunk, dtype = dtype, sep = ' ').reshape([-1, ncols])
+        
+        if nrows is None:
+            blocks.append(block)
+        else:
+            n_fit = np.min([block.shape[0], nrows - n_read])
+            data[n_read:n_read + n_fit, :] = block[:n_fit, :]
+        n_read += block.shape[0]
+        
+    if nrows is None:
+        if len(blocks) == 0:
+            return np.zeros([0, ncols], dtype = dtype)
+        return np.vstack(blocks)
+    
+    return data[:np.min([n_read, nrows]), :]
+    
+
+def _step_sample(blocks, t_grid, ncols, dtype = np.float64):
+
+    '''
+    Sample streamed records onto a time grid. Each grid time takes the last record at or before
+    it, or the first record for grid times before the start of the data.
+    
+    :param blocks: Iterable over (t, data) pairs of consecutive records in time order
+    
+    :param t_grid: Times to sample
+    
+    :param ncols: Number of values in each record
+    
+    :param dtype: Type of the data
+    
+    :returns: Array with one row per grid time and the index of the record used for each grid time
+    '''
+    
+    t_grid = np.asarray(t_grid, dtype = np.float64)
+    data = np.zeros([len(t_grid), ncols], dtype = dtype)
+    rec_ind = np.zeros(len(t_grid), dtype = np.int64)
+    n_read = 0
+    
+    for t, block in blocks:
         
+        if len(t) == 0:
+            break
+        
+        inds = np.searchsorted(t, t_grid, side = 'right') - 1
+        if n_read == 0:
+            inds = np.maximum(inds, 0)
+        found = inds >= 0
+        data[found, :] = block[inds[found], :]
+        rec_ind[found] = n_read + inds[found]
+        n_read += len(t)
+        
+    if n_read == 0:
+        return data[:0, :], rec_ind[:0]
+    return data, rec_ind
+    
 
 def StateInc(i):
     if _re.search('off', i):
@@ -1352,51 +1719,106 @@ def StateInc(i):
     return (state, inc)
     
     
-def Read_propensities(path, nRxn):
+def Read_output_array(path, bin_name, txt_name, ncols, mmap = False, write_bin = False):
     '''
-    Read propenisty data from output files. The initial time point: At t = 0 or after 0 events is wrong because
-    it is recorded before the first propensities are calculated. Instead, they are erroneously all zeros and should
-    not be used for averaging. The rest are correct.        
+    Read a matrix written by Zacros either as a raw float64 binary file or as ES30.16 formatted text,
+    with one record per line and blank lines in between. The binary file is used if it exists,
+    unless the text file has been modified after it.
     
-    :param Mode: 0 - Read Prop_output.bin, instantaneous propensities
-        1 - Read PropCounter_output.bin, time integrated propensities used for accurate time averages
+    :param path: Folder containing the files
+    
+    :param bin_name: Name of the binary file
+    
+    :param txt_name: Name of the text file
+    
+    :param ncols: Number of values in each record of the binary file
+    
+    :param mmap: True - return a read-only view of the binary file instead of loading it into memory
+    
+    :param write_bin: True - when only the text file exists, also save the data as the binary file so
+        that later reads are faster
         
-    :returns: Matrix of time integrated surface species populations
+    :returns: Matrix with one row per record, None if neither file exists
     '''
     
-    if os.path.isfile(os.path.join(path, 'Prop_output.bin')):
+    bin_path = os.path.join(path, bin_name)
+    txt_path = os.path.join(path, txt_name)
+    
+    use_bin = os.path.isfile(bin_path)
+    if use_bin and os.path.isfile(txt_path) and os.path.getmtime(txt_path) > os.path.getmtime(bin_path):
+        use_bin = False         # the binary file was saved from an older version of the text file
+    
+    if use_bin:
     
         dt = np.dtype(np.float64)
-        virtual_arr = np.memmap(os.path.join(path, 'Prop_output.bin'), dt, "r")
+        virtual_arr = np.memmap(os.path.join(path, bin_name), dt, "r")
         nNum = virtual_arr.shape[0]
-        nNum = nNum - (nNum % nRxn)
+        nNum = nNum - (nNum % ncols)
         virtual_arr = virtual_arr[:nNum]
     
-        prop = np.reshape(virtual_arr, [nNum/nRxn, nRxn])
-
+        data = np.reshape(virtual_arr, [nNum/ncols, ncols])
+        
+        if mmap:                # read-only view of the file
+            return data
         del virtual_arr
-        return np.array(prop)
+        return np.array(data)
         
-    elif os.path.isfile(os.path.join(path, 'propensities_output.txt')):
-    
-        with open(os.path.join(path, 'propensities_output.txt'), 'r') as txt:
-            RawTxt = txt.readlines()
-        prop = []
-        for i in range(len(RawTxt)):
+    elif os.path.isfile(txt_path):
+    
+        with open(txt_path, 'r') as txt:
+            lines = (line for line in txt if line.strip())        # skip the blank separator lines
+            first_line = next(lines, None)
+            if first_line is None:
+                return np.array([])
+            data = _read_numeric_block(_chain([first_line], lines), len(first_line.split()))
             
-            LineSplit = RawTxt[i].split()
-            line_data = []
-            if len(LineSplit) > 0:
-                for dub in LineSplit:
-                    line_data.append(np.float(dub))
-                prop.append(line_data)
-        return np.array(prop)
+        if write_bin:
+            try:            # replace the file, arrays memory-mapped from an older version keep their data
+                data.tofile(bin_path + '.tmp')
+                _ReplaceFile(bin_path + '.tmp', bin_path)
+            except (IOError, OSError):
+                pass
+            else:
+                if mmap:
+                    return Read_output_array(path, bin_name, txt_name, ncols, mmap = mmap)
+        
+        return data
     
     else:
         return None
+        
+        
+def Read_new_records(path, bin_name, ncols, file_pos = 0):
+    '''
+    Read the complete records added to a binary output file since a given position,
+    e.g. to follow a running simulation.
     
-
-def Read_time_integrated_propensities(path, nRxn):
+    :param path: Folder containing the file
+    
+    :param bin_name: Name of the binary file
+    
+    :param ncols: Number of values in each record
+    
+    :param file_pos: Number of bytes already read
+    
+    :returns: Matrix of the new records and the new file position
+    '''
+    
+    rec_bytes = 8 * ncols
+    fname = os.path.join(path, bin_name)
+    if not os.path.isfile(fname):
+        return np.zeros([0, ncols]), file_pos
+    
+    nNew = (os.path.getsize(fname) - file_pos) // rec_bytes
+    with open(fname, 'rb') as f:
+        f.seek(file_pos)
+        data = np.fromfile(f, dtype = np.float64, count = nNew * ncols)
+        
+    nNew = data.shape[0] // ncols
+    return data[:nNew * ncols].reshape([nNew, ncols]), file_pos + nNew * rec_bytes
+    
+    
+def Read_propensities(path, nRxn, mmap = False, write_bin = False):
     '''
     Read propenisty data from output files. The initial time point: At t = 0 or after 0 events is wrong because
     it is recorded before the first propensities are calculated. Instead, they are erroneously all zeros and should
@@ -1405,110 +1827,58 @@ def Read_time_integrated_propensities(path, nRxn):
     :param Mode: 0 - Read Prop_output.bin, instantaneous propensities
         1 - Read PropCounter_output.bin, time integrated propensities used for accurate time averages
         
+    :param mmap: True - return a read-only view of the .bin file instead of loading it into memory
+        
+    :param write_bin: True - save the data from the text file in the binary format on the first read
+        
     :returns: Matrix of time integrated surface species populations
     '''
     
-    if os.path.isfile(os.path.join(path, 'PropCounter_output.bin')):
+    return Read_output_array(path, 'Prop_output.bin', 'propensities_output.txt', nRxn, mmap = mmap, write_bin = write_bin)
     
-        dt = np.dtype(np.float64)
-        virtual_arr = np.memmap(os.path.join(path, 'PropCounter_output.bin'), dt, "r")
-        nNum = virtual_arr.shape[0]
-        nNum = nNum - (nNum % nRxn)
-        virtual_arr = virtual_arr[:nNum]
     
-        propCounter = np.reshape(virtual_arr, [nNum/nRxn, nRxn])
-            
-        del virtual_arr
-        return np.array(propCounter)
+def Read_time_integrated_propensities(path, nRxn, mmap = False, write_bin = False):
+    '''
+    Read propenisty data from output files. The initial time point: At t = 0 or after 0 events is wrong because
+    it is recorded before the first propensities are calculated. Instead, they are erroneously all zeros and should
+    not be used for averaging. The rest are correct.        
     
-    elif os.path.isfile(os.path.join(path, 'timeintprop_output.txt')):
+    :param Mode: 0 - Read Prop_output.bin, instantaneous propensities
+        1 - Read PropCounter_output.bin, time integrated propensities used for accurate time averages
+        
+    :param mmap: True - return a read-only view of the .bin file instead of loading it into memory
+        
+    :param write_bin: True - save the data from the text file in the binary format on the first read
+        
+    :returns: Matrix of time integrated surface species populations
+    '''
+    
+    return Read_output_array(path, 'PropCounter_output.bin', 'timeintprop_output.txt', nRxn, mmap = mmap, write_bin = write_bin)
     
-        with open(os.path.join(path, 'timeintprop_output.txt'), 'r') as txt:
-            RawTxt = txt.readlines()
-        propCounter = []
-        for i in range(len(RawTxt)):
-            
-            LineSplit = RawTxt[i].split()
-            line_data = []
-            if len(LineSplit) > 0:
-                for dub in LineSplit:
-                    line_data.append(np.float(dub))
-                propCounter.append(line_data)
-        
-        return np.array(propCounter)
-    else:    
-        return None
-
     
-def Read_trajectory_derivatives(path, nRxn):
+def Read_trajectory_derivatives(path, nRxn, mmap = False, write_bin = False):
     '''
     Read SA_output.bin - get trajectory derivatives for use in likelihood ratio sensitivity analysis
     
+    :param mmap: True - return a read-only view of the .bin file instead of loading it into memory
+        
+    :param write_bin: True - save the data from the text file in the binary format on the first read
+        
     :returns: Matrix of trajectory derivatives
     '''
-    dt = np.dtype(np.float64)
-    FileName = 'SA_output.bin'
-    if os.path.isfile(os.path.join(path, FileName)):
-        virtual_arr = np.memmap(os.path.join(path,
-                                               FileName), dt, "r")
-        nNum = virtual_arr.shape[0]
-        nNum = nNum - (nNum % nRxn)
-        virtual_arr = virtual_arr[:nNum]
-
-        W_sen_anal = np.reshape(virtual_arr, [nNum/nRxn, nRxn])
-
-        del virtual_arr
-        return np.array(W_sen_anal)
     
-    elif os.path.isfile(os.path.join(path, 'trajderiv_output.txt')):
-        with open(os.path.join(path, 'trajderiv_output.txt'), 'r') as txt:
-            RawTxt = txt.readlines()
-        W_sen_anal = []
-        for i in range(len(RawTxt)):
-            
-            LineSplit = RawTxt[i].split()
-            line_data = []
-            if len(LineSplit) > 0:
-                for dub in LineSplit:
-                    line_data.append(np.float(dub))
-                W_sen_anal.append(line_data)
-        return np.array(W_sen_anal)
-    else:    
-        return None
-
-
-def Read_time_integrated_species(path, n_surf_specs):
+    return Read_output_array(path, 'SA_output.bin', 'trajderiv_output.txt', nRxn, mmap = mmap, write_bin = write_bin)
+    
+    
+def Read_time_integrated_species(path, n_surf_specs, mmap = False, write_bin = False):
     '''
     Read time integrated species counts
     
+    :param mmap: True - return a read-only view of the .bin file instead of loading it into memory
+        
+    :param write_bin: True - save the data from the text file in the binary format on the first read
+        
     :returns: Matrix of time integrated surface species populations
     '''
     
-    if os.path.isfile(os.path.join(path, 'IntegSpec_output.bin')):
-        dt = np.dtype(np.float64)
-        virtual_arr = np.memmap(os.path.join(path, 'IntegSpec_output.bin'), dt, "r")
-        nNum = virtual_arr.shape[0]
-        nNum = nNum - (nNum % n_surf_specs)
-        virtual_arr = virtual_arr[:nNum]
-
-        spec_num_int = np.reshape(virtual_arr, [nNum/n_surf_specs, n_surf_specs])
-
-        del virtual_arr
-        return np.array(spec_num_int)
-        
-    elif os.path.isfile(os.path.join(path, 'timeintspecs_output.txt')): 
-        with open(os.path.join(path, 'timeintspecs_output.txt'), 'r') as txt:
-            RawTxt = txt.readlines()
-        spec_num_int = []
-        for i in range(len(RawTxt)):
-            
-            LineSplit = RawTxt[i].split()
-            line_data = []
-            if len(LineSplit) > 0:
-                for dub in LineSplit:
-                    line_data.append(np.float(dub))
-                spec_num_int.append(line_data)
-        return np.array(spec_num_int)
-        
-    else:    
-        return None
\ No newline at end of file
+    return Read_output_array(path, 'IntegSpec_output.bin', 'timeintspecs_output.txt', n_surf_specs, mmap = mmap, write_bin = write_bin)
@@ -8,18 +8,55 @@ import os
 import sys
 import subprocess
 import copy
+import json
+import time
 import re as _re
+from multiprocessing import Pool as _Pool
+from matplotlib.backends.backend_pdf import PdfPages as _PdfPages
 
 from utils import *
 from IO_data import *
 from Lattice import Lattice
 
+def _json_str(value):
+    
+    '''
+    Convert unicode strings loaded by json back to str
+    '''
+    
+    if isinstance(value, unicode):
+        return str(value)
+    elif isinstance(value, list):
+        return [_json_str(x) for x in value]
+    return value
+    
+
 class kmc_traj():
     
     '''
     Handles a single Zacros trajectory.
     '''
     
+    cache_fldr = 'zw_cache'             # subfolder with the parsed output saved in binary form
+    cache_version = 3
+    
+    # Files which the cached data depends on
+    cache_sources = ['simulation_input.dat', 'mechanism_input.dat', 'general_output.txt', 'specnum_output.txt',
+                     'procstat_output.txt', 'history_output.txt', 'lattice_output.txt', 'Prop_output.bin',
+                     'PropCounter_output.bin', 'SA_output.bin', 'IntegSpec_output.bin', 'propensities_output.txt',
+                     'timeintprop_output.txt', 'trajderiv_output.txt', 'timeintspecs_output.txt']
+                     
+    # Parsed output which is saved in the cache
+    cache_fields = ['genout.nRxn', 'genout.t_final', 'genout.events_occurred', 'genout.CPU_time', 'genout.RxnNameList',
+                    'genout.Nu', 'genout.UniqNu', 'specnumout.Spacing', 'specnumout.rec_ind', 'specnumout.nEvents', 'specnumout.t',
+                    'specnumout.T', 'specnumout.E', 'specnumout.spec', 'procstatout.Spacing', 'procstatout.t',
+                    'procstatout.events', 'histout.nSites', 'histout.final_snapshot', 'histout.final_time',
+                    'prop', 'propCounter', 'W_sen_anal', 'spec_num_int']
+    
+    mmap_fields = ['prop', 'propCounter', 'W_sen_anal', 'spec_num_int']       # can be memory-mapped
+    
+    complete_marker = 'zw_complete.txt'         # records a general_output.txt which has been checked for normal termination
+    
     def __init__(self, path = None):
         
         '''
@@ -84,44 +121,216 @@ class kmc_traj():
         self.statein.WriteIn(self.Path, self.simin.surf_spec)
 
         
-    def ReadAllOutput(self, build_lattice=False):
+    def ReadAllOutput(self, build_lattice=False, max_samples=20000, final_snap_only=False, use_cache=False, mmap=False, read_network=True, t_grid=None, write_bin=False):
         '''
         Read all Zacros output files
     
         :param build_lattice :     True - builds a Lattice object
             False - reads lattice_output.txt as text only
+            
+        :param max_samples :     Maximum number of records kept from specnum_output.txt and procstat_output.txt
+        
+        :param final_snap_only :     True - only read the last snapshot of history_output.txt, e.g. to continue the simulation
+            False - read all snapshots
+            
+        :param use_cache :     True - load the parsed output from the zw_cache subfolder if it is up to date,
+            otherwise parse the output files and save them there
+            False - always parse the output files
+            
+        :param mmap :     True - keep the propensity, trajectory derivative and integrated species data
+            as read-only memory-mapped views of the binary files instead of loading them into memory
+            
+        :param write_bin :     True - save propensity, trajectory derivative and integrated species data which is
+            only available as text in the corresponding binary files, so that later reads are faster
+            
+        :param read_network :     True - parse the reaction network in general_output.txt
+            False - keep the reaction names and stoichiometries already read for the same mechanism
+            
+        :param t_grid :     Times at which to sample the specnum, procstat and binary output instead of decimating
+            by max_samples. Each time takes the last record at or before it.
         '''
         
         #print 'Reading kMC trajectory data from ' + self.Path
         
         self.ReadAllInput()
 
-        if self.CheckComplete():
+        if self.CheckComplete(use_marker = use_cache):
+        
+            cache_options = {'max_samples': max_samples, 'final_snap_only': final_snap_only, 'read_network': read_network,
+                't_grid': None if t_grid is None else [float(t) for t in t_grid]}
+            
+            if use_cache and self.ReadCache(cache_options, mmap = mmap):
+            
+                if not final_snap_only:
+                    self.histout.ReadOut(self.Path, self.histout.nSites)
+            
+            else:
 
-            # Standard output files
-            self.genout.ReadOut(self.Path, self.simin.surf_spec, self.simin.gas_spec )
-            self.specnumout.ReadOut(self.Path)
-            if os.path.isfile(os.path.join(self.Path, 'procstat_output.txt')):
-                self.procstatout.ReadOut(self.Path)
+                # Standard output files
+                self.genout.ReadOut(self.Path, self.simin.surf_spec, self.simin.gas_spec, read_network = read_network)
+                self.specnumout.ReadOut(self.Path, max_samples = max_samples, t_grid = t_grid)
+                if os.path.isfile(os.path.join(self.Path, 'procstat_output.txt')):
+                    self.procstatout.ReadOut(self.Path, max_samples = max_samples, t_grid = t_grid)
+                    
+                # Count the number of sites
+                nSites = rawbigcount(os.path.join(self.Path, 'lattice_output.txt')) - 2
+                
+                if final_snap_only:
+                    self.histout.ReadFinal(self.Path, nSites)
+                else:
+                    self.histout.ReadOut(self.Path, nSites)
+    
+                # Extra output files
+                self.prop = Read_propensities(self.Path, len( self.genout.RxnNameList ), mmap = mmap, write_bin = write_bin)
+                self.propCounter = Read_time_integrated_propensities(self.Path, len( self.genout.RxnNameList ), mmap = mmap, write_bin = write_bin)
+                self.W_sen_anal = Read_trajectory_derivatives(self.Path, len( self.genout.RxnNameList ), mmap = mmap, write_bin = write_bin)
+                self.spec_num_int = Read_time_integrated_species(self.Path, len( self.simin.surf_spec ), mmap = mmap, write_bin = write_bin)
+                
+                # The binary output has a record for each specnum record, so use the same ones
+                if not t_grid is None:
+                    for field in self.mmap_fields:
+                        arr = getattr(self, field)
+                        if not arr is None and len(arr) > 0:
+                            setattr(self, field, arr[np.minimum(self.specnumout.rec_ind, len(arr) - 1), :])
+                
+                if use_cache:
+                    self.WriteCache(cache_options)
             
             if build_lattice:
                 self.lat.Read_lattice_output(self.Path)
-                
-            # Count the number of sites
-            with open( os.path.join(self.Path, 'lattice_output.txt'), 'r') as txt:
-                RawTxt = txt.readlines()
-            nSites = len(RawTxt) - 2
-            
-            self.histout.ReadOut(self.Path, nSites)
-
-            # Extra output files
-            self.prop = Read_propensities(self.Path, len( self.genout.RxnNameList ) )
-            self.propCounter = Read_time_integrated_propensities(self.Path, len( self.genout.RxnNameList ) )
-            self.W_sen_anal = Read_trajectory_derivatives(self.Path, len( self.genout.RxnNameList ))
-            self.spec_num_int = Read_time_integrated_species(self.Path, len( self.simin.surf_spec ))
 
         else:
             print 'general_output.txt not found in ' + self.Path
+            
+            
+    def cache_stamp(self, options):
+    
+        '''
+        Describe the state of the files the cache depends on
+        
+        :param options: Dictionary of the options used to parse the output
+        
+        :returns: Dictionary with the cache version, parsing options and the size and modification time of each source file
+        '''
+        
+        sources = {}
+        for fname in self.cache_sources:
+            fpath = os.path.join(self.Path, fname)
+            if os.path.isfile(fpath):
+                stats = os.stat(fpath)
+                sources[fname] = [stats.st_size, stats.st_mtime]
+            else:
+                sources[fname] = None
+                
+        return {'version': self.cache_version, 'options': options, 'sources': sources}
+        
+        
+    def ReadCache(self, options, mmap = False):
+    
+        '''
+        Load parsed output from the zw_cache subfolder
+        
+        :param options: Dictionary of the options used to parse the output
+        
+        :param mmap: Memory-map the cached propensity, trajectory derivative and integrated species arrays
+        
+        :returns: True if the cache was up to date and has been loaded, False otherwise
+        '''
+        
+        cache_path = os.path.join(self.Path, self.cache_fldr)
+        
+        try:
+            with open(os.path.join(cache_path, 'manifest.json'), 'r') as txt:
+                manifest = json.load(txt)
+        except (IOError, OSError, ValueError):
+            return False
+        
+        if not manifest['stamp'] == json.loads(json.dumps(self.cache_stamp(options))):
+            return False
+            
+        try:
+            values = {}
+            for field in self.cache_fields:
+                if field in manifest['arrays']:
+                    mmap_mode = 'r' if (mmap and field in self.mmap_fields) else None
+                    values[field] = np.load(os.path.join(cache_path, field + '.npy'), mmap_mode = mmap_mode)
+                else:
+                    values[field] = _json_str(manifest['values'][field])
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+            
+        for field in self.cache_fields:
+            self.set_field(field, values[field])
+        self.histout.fldr = self.Path
+        
+        return True
+        
+    
+    def WriteCache(self, options):
+    
+        '''
+        Save the parsed output in the zw_cache subfolder. Arrays are written as .npy files and
+        everything else in manifest.json. The old manifest.json is removed before any array is
+        written and the new one is written last, so a partly written cache is never used.
+        
+        :param options: Dictionary of the options used to parse the output
+        '''
+        
+        cache_path = os.path.join(self.Path, self.cache_fldr)
+        manifest = {'stamp': self.cache_stamp(options), 'arrays': [], 'values': {}}
+        
+        try:
+        
+            if not os.path.exists(cache_path):
+                os.makedirs(cache_path)
+            
+            if os.path.isfile(os.path.join(cache_path, 'manifest.json')):
+                os.remove(os.path.join(cache_path, 'manifest.json'))
+                
+            for field in self.cache_fields:
+                value = self.get_field(field)
+                if isinstance(value, np.ndarray):
+                    # Replace the file instead of overwriting it, arrays memory-mapped from the old file keep their data
+                    with open(os.path.join(cache_path, field + '.npy.tmp'), 'wb') as npy:
+                        np.save(npy, value)
+                    ReplaceFile(os.path.join(cache_path, field + '.npy.tmp'), os.path.join(cache_path, field + '.npy'))
+                    manifest['arrays'].append(field)
+                elif isinstance(value, np.generic):
+                    manifest['values'][field] = value.item()
+                else:
+                    manifest['values'][field] = value
+                    
+            with open(os.path.join(cache_path, 'manifest.tmp'), 'w') as txt:
+                json.dump(manifest, txt)
+            ReplaceFile(os.path.join(cache_path, 'manifest.tmp'), os.path.join(cache_path, 'manifest.json'))
+            
+        except (IOError, OSError, TypeError):         # a missing cache only costs time
+            pass
+            
+            
+    def get_field(self, field):
+        
+        '''
+        Get a variable from a dotted name such as 'genout.Nu'
+        '''
+        
+        obj = self
+        for name in field.split('.'):
+            obj = getattr(obj, name)
+        return obj
+        
+    
+    def set_field(self, field, value):
+        
+        '''
+        Set a variable from a dotted name such as 'genout.Nu'
+        '''
+        
+        names = field.split('.')
+        obj = self
+        for name in names[:-1]:
+            obj = getattr(obj, name)
+        setattr(obj, names[-1], value)
     
     
     '''
@@ -149,19 +358,57 @@ class kmc_traj():
             raise Exception('Zacros run in ' + self.Path + ' failed.')
        
     
-    def CheckComplete(self):
+    def CheckComplete(self, tail_bytes = 65536, use_marker = False):
     
         '''
         Check to see if a Zacros run has completed successfully
+        
+        :param tail_bytes: Only search this many bytes at the end of general_output.txt, where Zacros writes
+            "Normal termination". If None, search the whole file.
+            
+        :param use_marker: Save the size and modification time of a completed general_output.txt in a marker
+            file, so that later checks of the same run do not need to open it
         '''
         
+        fname = os.path.join(self.Path, 'general_output.txt')
+        marker_fname = os.path.join(self.Path, self.complete_marker)
+        
+        try:
+            stats = os.stat(fname)
+        except OSError:
+            return False
+        stamp = '%d %r' % (stats.st_size, stats.st_mtime)
+            
+        if use_marker:
+            try:
+                with open(marker_fname, 'r') as txt:
+                    if txt.read() == stamp:
+                        return True
+            except IOError:
+                pass
+        
+        key = b'Normal termination'
         Complete = False
-        if os.path.isfile(os.path.join(self.Path, 'general_output.txt')):
-            with open(os.path.join(self.Path, 'general_output.txt'), 'r') as txt:
-                RawTxt = txt.readlines()
-            for i in RawTxt:
-                if _re.search('Normal termination', i):
-                    Complete = True
+        with open(fname, 'rb') as txt:
+        
+            if not tail_bytes is None:
+                txt.seek(np.max([0, stats.st_size - tail_bytes]))
+                Complete = key in txt.read()
+            else:
+                buf = b''
+                for block in iter(lambda: txt.read(1024*1024), b''):
+                    buf = buf[1-len(key):] + block          # catch a match split across blocks
+                    if key in buf:
+                        Complete = True
+                        break
+                    
+        if Complete and use_marker:
+            try:
+                with open(marker_fname, 'w') as txt:
+                    txt.write(stamp)
+            except IOError:
+                pass
+                
         return Complete
         
     
@@ -192,11 +439,7 @@ class kmc_traj():
         if t > self.specnumout.t[-1] or t < 0:
             raise Exception('Time is out of range.')
         
-        ind = 0
-        while self.specnumout.t[ind] < t:
-            ind += 1
-            
-        return ind
+        return int(np.searchsorted(self.specnumout.t, t, side = 'left'))
         
     
     def time_avg_covs(self, t1 = 0, t2 = None):
@@ -210,13 +453,10 @@ class kmc_traj():
         if t2 is None:          # Use final time by default
             t2 = self.specnumout.t[-1]
         
-        idb_start = self.time_search_interp(t1)
-        idb_end = self.time_search_interp(t2)
-        
-        cov_integ_start = idb_start[1][0] * self.spec_num_int[idb_start[0][0], :] + idb_start[1][1] * self.spec_num_int[idb_start[0][1], :]
-        cov_integ_end = idb_end[1][0] * self.spec_num_int[idb_end[0][0], :] + idb_end[1][1] * self.spec_num_int[idb_end[0][1], :]
+        inds, fracs = self.time_search_interp_batch([t1, t2])
+        cov_integ = fracs[:,0:1] * self.spec_num_int[inds[:,0], :] + fracs[:,1:2] * self.spec_num_int[inds[:,1], :]
         
-        return ( cov_integ_end  - cov_integ_start ) / (t2 - t1)
+        return ( cov_integ[1,:]  - cov_integ[0,:] ) / (t2 - t1)
     
     def time_search_interp(self, t):
         
@@ -230,27 +470,39 @@ class kmc_traj():
             weighting factor for higher point
         '''
         
-        if t > self.specnumout.t[-1] or t < 0:
+        inds, fracs = self.time_search_interp_batch([t])
+        return [[int(inds[0,0]), int(inds[0,1])], [fracs[0,0], fracs[0,1]]]
+        
+        
+    def time_search_interp_batch(self, t_query):
+        
+        '''
+        Get the information necessary to linearly interpolate data between time points at many times at once,
+        using a binary search of the sorted time points
+        
+        :param t_query: Array of times at which you want to compute interpolated data
+        :returns: Array of indices (n_times x 2) of the time points less than or equal to and greater than or equal to each time,
+            and array of weighting factors (n_times x 2) for the lower and higher points
+        '''
+        
+        t_query = np.asarray(t_query, dtype = float)
+        t = self.specnumout.t
+        
+        if np.any(t_query > t[-1]) or np.any(t_query < 0):
             raise Exception('Time is out of range.')
         
-        ind_geq = 0
-        while self.specnumout.t[ind_geq] < t:
-            ind_geq += 1
-            
-        ind_leq = len( self.specnumout.t ) - 1        # set it initially equal to the last index
-        while self.specnumout.t[ind_leq] > t:
-            ind_leq -= 1
+        ind_geq = np.searchsorted(t, t_query, side = 'left')
+        ind_leq = np.searchsorted(t, t_query, side = 'right') - 1
         
-        if ind_geq - ind_leq < 0 or ind_geq - ind_leq > 1:
+        if np.any(ind_leq < 0) or np.any(ind_geq - ind_leq < 0) or np.any(ind_geq - ind_leq > 1):
             raise Exception('Time indices are wrong')
         
-        low_frac = 1.0
-        if not (ind_geq == ind_leq):
-            low_frac = (self.specnumout.t[ind_geq] - t) / (self.specnumout.t[ind_geq] - self.specnumout.t[ind_leq])
-            
+        low_frac = np.ones(len(t_query))
+        between = ind_geq != ind_leq
+        low_frac[between] = (t[ind_geq[between]] - t_query[between]) / (t[ind_geq[between]] - t[ind_leq[between]])
         high_frac = 1.0 - low_frac
         
-        return [[ind_leq, ind_geq], [low_frac, high_frac]]
+        return np.column_stack([ind_leq, ind_geq]), np.column_stack([low_frac, high_frac])
     
 
     '''
@@ -386,7 +638,8 @@ class kmc_traj():
             plt.close()
         
         
-    def LatticeMovie(self, include_neighbor_lines = False, spec_color_list = ['b', 'g','r','c','m','y','k']):       # Need make marker type consistent with the site type
+    def LatticeMovie(self, include_neighbor_lines = False, spec_color_list = ['b', 'g','r','c','m','y','k'], frame_stride = 1,
+                    n_procs = 1, movie_fname = None):       # Need make marker type consistent with the site type
 
         '''
         Create a subfolder called lattice_frames
@@ -394,47 +647,266 @@ class kmc_traj():
         
         include_neighbor_lines :    If true, will draw lines between neighboring lattice sites (takes more time)
         spec_color_list :           List of colors to use for different species, will cycle through if there are more species than colors
+        frame_stride :              Only draw every frame_stride-th snapshot
+        n_procs :                   Number of processes drawing the .png files. Each process draws the lattice once
+                                    and a contiguous block of the frames.
+        movie_fname :               Write all frames to this single file in lattice_frames instead of separate .png files.
+                                    A .pdf file has one page per frame. Other extensions are encoded with a matplotlib
+                                    animation writer, e.g. .mp4 (ffmpeg) or .gif (imagemagick).
         '''
     
         cart_coords = self.lat.cart_coords
-        spec_label_list = self.simin.surf_spec
         
         frame_fldr = os.path.join(self.Path, 'lattice_frames')
         if not os.path.exists( frame_fldr ):
                 os.makedirs( frame_fldr )
+        
+        if len(self.histout.snapshots) == 0:           # snapshots have not been read, only seek to the ones which are drawn
+            self.histout.ReadIndex(self.Path, cart_coords.shape[0])
                 
         print str(self.histout.n_snapshots) + ' total snapshots'
         
-        for frame_num in range(self.histout.n_snapshots):
+        frame_inds = range(self.histout.n_snapshots)[::frame_stride]
+        if not movie_fname is None or n_procs < 2 or len(frame_inds) < 2:
+            _draw_lattice_frames(self.lat, self.histout, self.simin.surf_spec, spec_color_list, frame_fldr,
+                                 0, None, frame_stride, movie_fname = movie_fname)
+            return
+        
+        # Give each process a block of frames, it reads its own snapshots from history_output.txt.
+        # Only the snapshot index is sent to the processes, not snapshots which are already in memory.
+        if self.histout.snap_offsets is None:
+            index = HistoryOut()
+            index.ReadIndex(self.Path, cart_coords.shape[0])
+        else:
+            index = self.histout
+        
+        jobs = []
+        for block in np.array_split(frame_inds, min(n_procs, len(frame_inds))):
+            jobs.append( (self.lat, index.fldr, index.nSites, index.snap_offsets, index.snap_times,
+                          self.simin.surf_spec, spec_color_list, frame_fldr, block[0], block[-1] + 1, frame_stride) )
+        
+        pool = _Pool(n_procs)
+        try:
+            pool.map(_draw_lattice_frames_job, jobs)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
             
-            print 'Draw frame number ' + str(frame_num+1)
-            snap = self.histout.snapshots[frame_num]
+
+def _draw_lattice_frames(lat, histout, spec_label_list, spec_color_list, frame_fldr, start, stop, stride, movie_fname = None):
+
+    '''
+    Draw lattice snapshots. The lattice is plotted once and only the species markers,
+    the title and the legend are updated for each frame.
+    
+    :param lat: Lattice
+    
+    :param histout: HistoryOut with the snapshots or the snapshot index
+    
+    :param spec_label_list: Names of the surface species
+    
+    :param spec_color_list: Colors of the surface species
+    
+    :param frame_fldr: Folder to save the frames in
+    
+    :param start, stop, stride: Snapshots to draw, as in HistoryOut.iter_snapshots
+    
+    :param movie_fname: Name of a single file to write all of the frames to
+    '''
+    
+    cart_coords = lat.cart_coords
+    
+    plt = lat.PlotLattice()            # static lattice background
+    fig = plt.gcf()
+    spec_lines = []
+    for ind in range( len( spec_label_list ) ):
+        spec_lines.append( plt.plot([], [], linestyle='None', marker = 'o', color = spec_color_list[ind % len(spec_color_list)],
+                                    markersize = 3, label=spec_label_list[ind])[0] )
+    
+    # Open the single output file
+    writer = None
+    if not movie_fname is None:
+        movie_path = os.path.join(frame_fldr, movie_fname)
+        if movie_fname.lower().endswith('.pdf'):
+            writer = _PdfPages(movie_path)
+        else:
+            import matplotlib.animation as animation
+            ext_writers = {'.mp4': 'ffmpeg', '.avi': 'ffmpeg', '.mov': 'ffmpeg', '.gif': 'imagemagick', '.html': 'html'}
+            writer_name = ext_writers.get(os.path.splitext(movie_fname)[1].lower())
+            if writer_name is None or not animation.writers.is_available(writer_name):
+                plt.close()
+                raise NameError('No animation writer is available for ' + movie_fname + '. Use a .pdf file instead.')
+            writer = animation.writers[writer_name]()
+            writer.setup(fig, movie_path)
+    
+    for frame_num, snap in histout.iter_snapshots(start = start, stop = stop, stride = stride):
+        
+        print 'Draw frame number ' + str(frame_num+1)
+        
+        species = snap[:,2]                 # include empty sites
+        for ind in range( len( spec_lines ) ):
+            is_spec = species == ind+1          # all sites with species ind occupying it
+            spec_lines[ind].set_data(cart_coords[is_spec,0], cart_coords[is_spec,1])
+        
+        plt.title('Time: ' + str(histout.snap_times[frame_num]) + ' sec')
+        plt.legend(frameon=False, loc=4)
+        
+        if writer is None:
+            fig.savefig(os.path.join(frame_fldr, 'Snapshot_' + str(frame_num+1)))
+        elif isinstance(writer, _PdfPages):
+            writer.savefig(fig)
+        else:
+            writer.grab_frame()
+    
+    if isinstance(writer, _PdfPages):
+        writer.close()
+    elif not writer is None:
+        writer.finish()
+    plt.close()
+    
+    
+def _draw_lattice_frames_job(args):
+    
+    '''
+    Draw a block of lattice frames in a worker process
+    
+    :param args: Lattice, folder of history_output.txt, number of sites, snapshot byte offsets,
+        snapshot times, then the arguments of _draw_lattice_frames after histout
+    '''
+    
+    lat, fldr, nSites, snap_offsets, snap_times = args[:5]
+    
+    histout = HistoryOut()
+    histout.fldr = fldr
+    histout.nSites = nSites
+    histout.snap_offsets = snap_offsets
+    histout.snap_times = snap_times
+    histout.n_snapshots = len(snap_offsets)
+    
+    _draw_lattice_frames(lat, histout, *args[5:])
+    
+
+class traj_monitor(object):
+    
+    '''
+    Follows the output of a Zacros trajectory while it is running. Each call to Update reads only
+    the records written since the previous call and tracks the progress of the simulation.
+    Only the last record of each output and the progress at the last few updates are kept.
+    '''
+    
+    n_updates_kept = 10         # Number of updates kept in wall_time, sim_time and n_events
+    
+    def __init__(self, path = None):
+        
+        '''
+        Initialize class variables
+        '''
+        
+        self.Path = path                        # Path to the folder of the running trajectory
+        self.simin = SimIn()                    # data from simulation_input.dat, used for the stopping criteria
+        self.specnumout = SpecnumOut()          # last record of specnum_output.txt
+        self.procstatout = ProcstatOut()        # last record of procstat_output.txt
+        
+        self.prop = None                        # last record of Prop_output.bin
+        self.propCounter = None                 # last record of PropCounter_output.bin
+        self.bin_pos = {'Prop_output.bin': 0, 'PropCounter_output.bin': 0}
+        
+        # Progress at each call to Update
+        self.wall_time = []                     # seconds since the epoch
+        self.sim_time = []                      # simulated time
+        self.n_events = []                      # number of KMC events
         
-            plt = self.lat.PlotLattice()            # plot the lattice in this frame
         
+    def Update(self):
+    
+        '''
+        Read the new output and record the progress of the trajectory
+        
+        :returns: Number of new specnum records
+        '''
+        
+        if self.simin.Seed is None and os.path.isfile(os.path.join(self.Path, 'simulation_input.dat')):
+            self.simin.ReadIn(self.Path)
+        
+        nNew = 0
+        if os.path.isfile(os.path.join(self.Path, self.specnumout.fname)):
+            nNew = self.specnumout.ReadNew(self.Path)
+            if not self.specnumout.t is None:           # keep only the last record
+                for field in ['nEvents', 't', 'T', 'E', 'spec']:
+                    setattr(self.specnumout, field, getattr(self.specnumout, field)[-1:])
+        if os.path.isfile(os.path.join(self.Path, self.procstatout.fname)):
+            self.procstatout.ReadNew(self.Path)
+            if not self.procstatout.t is None:
+                self.procstatout.t = self.procstatout.t[-1:]
+                self.procstatout.events = self.procstatout.events[-1:]
             
-            for ind in range( len( self.simin.surf_spec ) ):
-                
-                # Find all coordinates with species ind occupying it
-                x_list = []
-                y_list = []
-                for site_ind in range(cart_coords.shape[0]):      # include empty sites
-                    if snap[site_ind,2] == ind+1:
-                        x_list.append(cart_coords[site_ind,0])
-                        y_list.append(cart_coords[site_ind,1])
-        
-                x = np.array(x_list)
-                y = np.array(y_list)                
-                
-                plt.plot(x, y, linestyle='None', marker = 'o', color = spec_color_list[ind % len(spec_color_list)], markersize = 3, label=spec_label_list[ind])
+        # The number of reactions is known from the procstat header
+        if not self.procstatout.events is None:
+            nRxn = self.procstatout.events.shape[1]
+            new_prop, self.bin_pos['Prop_output.bin'] = Read_new_records(self.Path, 'Prop_output.bin', nRxn, self.bin_pos['Prop_output.bin'])
+            new_propCounter, self.bin_pos['PropCounter_output.bin'] = Read_new_records(self.Path, 'PropCounter_output.bin', nRxn, self.bin_pos['PropCounter_output.bin'])
+            if len(new_prop) > 0:
+                self.prop = new_prop[-1]
+            if len(new_propCounter) > 0:
+                self.propCounter = new_propCounter[-1]
+        
+        if not self.specnumout.t is None and len(self.specnumout.t) > 0:
+            self.wall_time = self.wall_time[1 - self.n_updates_kept:] + [time.time()]
+            self.sim_time = self.sim_time[1 - self.n_updates_kept:] + [self.specnumout.t[-1]]
+            self.n_events = self.n_events[1 - self.n_updates_kept:] + [self.specnumout.nEvents[-1]]
             
-            plt.title('Time: ' + str(self.histout.snap_times[frame_num]) + ' sec')
-            plt.legend(frameon=False, loc=4)
-                
-            plt.savefig(os.path.join(frame_fldr, 'Snapshot_' + str(frame_num+1)))
-            plt.close()
+        return nNew
+        
+        
+    def events_per_sec(self):
+        
+        '''
+        :returns: KMC events per second of wall time between the last two updates
+        '''
+        
+        if len(self.wall_time) < 2 or self.wall_time[-1] == self.wall_time[-2]:
+            return None
+        return (self.n_events[-1] - self.n_events[-2]) / (self.wall_time[-1] - self.wall_time[-2])
+        
+        
+    def sim_time_per_sec(self):
+        
+        '''
+        :returns: Simulated time per second of wall time between the last two updates
+        '''
+        
+        if len(self.wall_time) < 2 or self.wall_time[-1] == self.wall_time[-2]:
+            return None
+        return (self.sim_time[-1] - self.sim_time[-2]) / (self.wall_time[-1] - self.wall_time[-2])
+        
+        
+    def ETA(self):
+        
+        '''
+        Estimate the remaining wall time from the current speed and the max_time and max_steps
+        stopping criteria in simulation_input.dat
+        
+        :returns: Seconds until the trajectory finishes, None if it cannot be estimated
+        '''
+        
+        remaining = []
+        
+        sim_rate = self.sim_time_per_sec()
+        if not sim_rate is None and sim_rate > 0 and isinstance(self.simin.SimTime_Max, float):
+            remaining.append( (self.simin.SimTime_Max - self.sim_time[-1]) / sim_rate )
+            
+        event_rate = self.events_per_sec()
+        if not event_rate is None and event_rate > 0 and isinstance(self.simin.MaxStep, (int, long)):
+            remaining.append( (self.simin.MaxStep - self.n_events[-1]) / event_rate )
+            
+        if len(remaining) == 0:
+            return None
+        return np.max([np.min(remaining), 0.])
+        
             
-
 def append_trajectories(run1, run2):
     
     '''
@@ -9,8 +9,10 @@ import os
 import numpy as np
 import matplotlib as mat
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from scipy.spatial import cKDTree
 
-class Lattice:
+class Lattice(object):
     
     '''
     Class which handles the KMC lattice
@@ -34,7 +36,7 @@ class Lattice:
         self.site_type_inds = []
         self.frac_coords = []
         self.cart_coords = []
-        self.neighbor_list = []
+        self.neighbor_list = []                 # also clears neighbor_indptr and neighbor_indices
         self.cell_list = []     # self, north, northeast, east, or southeast
 
         
@@ -106,25 +108,36 @@ class Lattice:
         :param b_ind: Index of atom B
         '''
 
-        a_coords = self.cart_coords[ a_ind , : ]
+        image_coords, dists = self.coord_shift_batch([a_ind], [b_ind])
+        return image_coords[0]
+        
+        
+    def coord_shift_batch(self, a_inds, b_inds):
 
-        image_coords = [ self.cart_coords[ b_ind , : ] for i in range(9) ]
-        dist_list = [None for i in range(9)]
-        ind = 0
-        for we in [-1, 0, 1]:
-            for sn in [-1, 0, 1]:
-                image_coords[ind] = image_coords[ind] + np.dot(np.array([we, sn]), self.lattice_matrix)
-                dist_list[ind] = np.linalg.norm( image_coords[ind] - a_coords )
-                ind += 1
+        '''
+        Give the coordinates of the periodic images of B which are closest to A for many pairs of atoms.
+        All 9 periodic images are compared at once by broadcasting.
+        
+        :param a_inds: Array of indices of atoms A
+        
+        :param b_inds: Array of indices of atoms B, the same length as a_inds
+        
+        :returns: Array of the closest image coordinates of each B (n_pairs x 2) and
+            array of the distances from each A to that image
+        '''
 
-        min_d = dist_list[0]
-        min_d_ind = 0
-        for i in range(1,9):
-            if dist_list[i] < min_d:
-                min_d = dist_list[i]
-                min_d_ind = i
-        
-        return image_coords[min_d_ind]
+        a_coords = self.cart_coords[ np.asarray(a_inds, dtype = int) , : ]
+        b_coords = self.cart_coords[ np.asarray(b_inds, dtype = int) , : ]
+        
+        # Shifts in the same order as the images were compared one at a time, so ties are broken the same way
+        shifts = np.array([ np.dot(np.array([we, sn]), self.lattice_matrix) for we in [-1, 0, 1] for sn in [-1, 0, 1] ])
+        
+        image_coords = b_coords[:, np.newaxis, :] + shifts[np.newaxis, :, :]       # n_pairs x 9 x 2
+        dist_list = np.sqrt( np.sum( (image_coords - a_coords[:, np.newaxis, :]) ** 2, axis = 2 ) )
+        min_d_inds = np.argmin(dist_list, axis = 1)
+        
+        pair_inds = np.arange(len(min_d_inds))
+        return image_coords[pair_inds, min_d_inds, :], dist_list[pair_inds, min_d_inds]
     
     
     def PlotLattice(self, cutoff = 3.0, plot_neighbs = False, type_symbols = ['o','s','^','v', '<', '>', '8', 
@@ -161,22 +174,17 @@ class Lattice:
         
         plt.plot(border[:,0], border[:,1], '--k', linewidth = 2)                  # cell border 
 
-        if plot_neighbs:
-            ind = 0
-            for pair in self.neighbor_list:                                             # neighbors
-                p1 = self.cart_coords[pair[0],:]
-                p2 = self.cart_coords[pair[1],:]
-                if self.cell_list[ind] == 'self':
-                    plt.plot([p1[0], p2[0]], [p1[1], p2[1]], '-k', linewidth = 1)
-                ind += 1
+        if plot_neighbs and len(self.neighbor_list) > 0:                               # neighbors, as one collection of segments
+            pairs = np.array(self.neighbor_list)
+            in_cell = np.array(self.cell_list) == 'self'
+            segments = self.cart_coords[pairs[in_cell], :]          # n_segments x 2 points x 2 coordinates
+            plt.gca().add_collection(LineCollection(segments, colors = 'k', linewidths = 1, zorder = 2))
+            plt.gca().autoscale_view()
 
-        for site_type in range(1, np.max(np.array(self.site_type_inds))+1 ):
+        site_type_inds = np.array(self.site_type_inds)
+        for site_type in range(1, np.max(site_type_inds)+1 ):
 
-            is_of_type = []
-            
-            for site_ind in range(len(self.site_type_inds)):
-                if self.site_type_inds[site_ind] == site_type:
-                    is_of_type.append(site_ind)
+            is_of_type = site_type_inds == site_type
             
             plt.plot(self.cart_coords[is_of_type,0], self.cart_coords[is_of_type,1], linestyle='None', marker = type_symbols[(site_type-1) % len(type_symbols)], color = [0.8, 0.8, 0.8], markersize = ms)          # sites  
         
@@ -204,42 +212,82 @@ class Lattice:
     def Read_lattice_output(self, fldr):
     
         '''
-        Read lattice_output.txt
+        Read lattice_output.txt. The site information is parsed as one numeric block and the
+        neighbors are stored in compressed sparse row form: the neighbors of site i (0-based)
+        are neighbor_indices[neighbor_indptr[i]:neighbor_indptr[i+1]], also 0-based.
         '''
     
         with open( os.path.join(fldr, self.fname_out) ,'r') as txt:
-            RawTxt = txt.readlines()           
-        n_sites = len(RawTxt) - 2
-        self.cart_coords = np.zeros([n_sites,2])        
+            line1 = txt.readline().split()
+            line2 = txt.readline().split()
+            SiteTxt = txt.read()
         
         # Fill in lattice vectors
         self.lattice_matrix = np.zeros([2,2])
-        line1 = RawTxt[0].split()
         self.lattice_matrix[0,0] = float(line1[1])
         self.lattice_matrix[0,1] = float(line1[2])
-        line2 = RawTxt[1].split()
         self.lattice_matrix[1,0] = float(line2[1])
         self.lattice_matrix[1,1] = float(line2[2])
         
+        # Each line is: site, x, y, site type, coordination, neighbors padded with zeros
+        n_sites = SiteTxt.count('\n')
+        if not SiteTxt.endswith('\n') and SiteTxt.strip():
+            n_sites += 1
+        data = np.fromstring(SiteTxt, sep = ' ')
+        
+        # All rows must have as many values as the first one. Rows of different lengths can still add up to
+        # a multiple of it, so also check that the site numbers and coordination numbers line up.
+        ncols = len(SiteTxt[:SiteTxt.find('\n')].split()) if '\n' in SiteTxt else len(SiteTxt.split())
+        same_length = n_sites > 0 and ncols >= 5 and data.size == n_sites * ncols
+        if same_length:
+            data = data.reshape([n_sites, ncols])
+            same_length = np.array_equal(data[:, 0], np.arange(1, n_sites + 1)) and \
+                np.array_equal(data[:, 4], np.sum(data[:, 5:] > 0, axis = 1))
+        
+        if not same_length:        # lines of different lengths
+            rows = [line.split() for line in SiteTxt.splitlines() if line.strip()]
+            n_sites = len(rows)
+            ncols = np.max([len(row) for row in rows]) if rows else 5
+            data = np.zeros([n_sites, ncols])
+            for site_ind, row in enumerate(rows):
+                data[site_ind, :len(row)] = [float(x) for x in row]
+        
         # Fill in site coordinates and neighbors
-        self.neighbor_list = []
-        self.site_type_inds = []
-        for site_ind in range(n_sites):
-            line = RawTxt[site_ind+2].split()
-            self.cart_coords[site_ind,:] = [line[1], line[2]]
-            self.site_type_inds.append(int(line[3]))
-            neighbs = line[5::]
-            for site_2 in neighbs:
-                if int(site_2) > 0:         # Zeros are placeholders in the output file
-                    self.neighbor_list.append([site_ind+1, int(site_2)])
+        self.cart_coords = np.array(data[:, 1:3])
+        self.site_type_inds = data[:, 3].astype(int)
+        
+        neighbs = data[:, 5:].astype(int)
+        is_neighb = neighbs > 0         # Zeros are placeholders in the output file
+        self.neighbor_indptr = np.concatenate([[0], np.cumsum(np.sum(is_neighb, axis = 1))])
+        self.neighbor_indices = neighbs[is_neighb] - 1
+        self._neighbor_list = None       # built from the sparse form when it is used
         
         # Convert to fractional coordinates
         self.frac_coords = np.dot(self.cart_coords, np.linalg.inv(self.lattice_matrix))
     
         self.text_only = False
+        
+        
+    @property
+    def neighbor_list(self):
+        
+        '''
+        List of [site 1, site 2] neighbor pairs. After Read_lattice_output the pairs are 1-based
+        and are built from the sparse neighbor arrays the first time they are used.
+        '''
+        
+        if self._neighbor_list is None:
+            site_1 = np.repeat(np.arange(len(self.neighbor_indptr) - 1), np.diff(self.neighbor_indptr))
+            self._neighbor_list = np.column_stack([site_1 + 1, self.neighbor_indices + 1]).tolist()
+        return self._neighbor_list
+        
+    @neighbor_list.setter
+    def neighbor_list(self, value):
+        self._neighbor_list = value
+        self.neighbor_indptr = None
+        self.neighbor_indices = None
 
     
-    
     def Write_lattice_input(self, fldr):
 
         '''
@@ -289,10 +337,11 @@ class Lattice:
         txt.close()
         
         
-    def Build_neighbor_list(self, cut = 3.0, cut_mat = []):     # appending lists causes this method to be slow
+    def Build_neighbor_list(self, cut = 3.0, cut_mat = []):
     
         '''
-        Builds the neighbor list based on distances between sites
+        Builds the neighbor list based on distances between sites. Candidate pairs are found with
+        a KD-tree for the cell and each of its north, northeast, east and southeast images.
         
         :param cut: Maximum distance between nearest neighbor sites or their periodic images.
         
@@ -300,50 +349,51 @@ class Lattice:
             all site types.
         '''
     
-        # Make sure these lists are empty before we start appending
-        self.neighbor_list = []
-        self.cell_list = []     # self, north, northeast, east, or southeast
-    
         if self.cart_coords == []:
             self.cart_coords = np.dot(self.frac_coords, self.lattice_matrix)
     
         n_site_types = len(self.site_type_names)
-        n_sites = len(self.site_type_inds)
         self.cart_coords = np.dot(self.frac_coords, self.lattice_matrix)
     
         if cut_mat == []:
             cut_mat = cut * np.ones([n_site_types, n_site_types])        # Use a matrix to have different cutoff distances for different site types
+        cut_mat = np.array(cut_mat, dtype = float)
+        site_types = np.array(self.site_type_inds, dtype = int) - 1
+        
+        # Periodic images of site 2 which are checked, in the order they are listed for each pair
+        cell_names = ['self', 'north', 'northeast', 'east', 'southeast']
+        shifts = [[], [self.lattice_matrix[1,:]], [self.lattice_matrix[0,:], self.lattice_matrix[1,:]],
+                  [self.lattice_matrix[0,:]], [self.lattice_matrix[0,:], -self.lattice_matrix[1,:]]]
+        
+        tree_1 = cKDTree(self.cart_coords)
+        site_1_list = []
+        site_2_list = []
+        cell_ind_list = []
+        
+        for cell_ind, shift in enumerate(shifts):
+        
+            # Candidates within the largest cutoff
+            c_2 = self.cart_coords
+            for vec in shift:
+                c_2 = c_2 + vec
+            candidates = tree_1.query_ball_tree(cKDTree(c_2), np.max(cut_mat))
+            site_1 = np.repeat(np.arange(len(candidates)), [len(c) for c in candidates])
+            site_2 = np.array([j for c in candidates for j in c], dtype = int)
             
-        # Loop through all sites
-        for site_1 in range(n_sites):
-            for site_2 in range(n_sites):
-            
-                c1 = self.cart_coords[site_1,:]
-                c2 = self.cart_coords[site_2,:]
-            
-                c_2_north = c2 + self.lattice_matrix[1,:]
-                c_2_northeast = c2 + self.lattice_matrix[0,:] + self.lattice_matrix[1,:]
-                c_2_east = c2 + self.lattice_matrix[0,:]
-                c_2_southeast = c2 + self.lattice_matrix[0,:] - self.lattice_matrix[1,:]
-            
-                if site_1 < site_2:        # check self
-                    if np.linalg.norm( c1 - c2 ) < cut:
-                        self.neighbor_list.append([site_1, site_2])
-                        self.cell_list.append('self')
-                        
-                if np.linalg.norm( c1 - c_2_north ) < cut:
-                    self.neighbor_list.append([site_1, site_2])
-                    self.cell_list.append('north')
-                        
-                if np.linalg.norm( c1 - c_2_northeast ) < cut:
-                    self.neighbor_list.append([site_1, site_2])
-                    self.cell_list.append('northeast')
-                    
-                if np.linalg.norm( c1 - c_2_east ) < cut:
-                    self.neighbor_list.append([site_1, site_2])
-                    self.cell_list.append('east')
-                    
-                if np.linalg.norm( c1 - c_2_southeast ) < cut:
-                    self.neighbor_list.append([site_1, site_2])
-                    self.cell_list.append('southeast')
-        
\ No newline at end of file
+            # Apply the cutoff for the types of the two sites
+            dist = np.sqrt(np.sum((self.cart_coords[site_1,:] - c_2[site_2,:]) ** 2, axis = 1))
+            is_neighb = dist < cut_mat[site_types[site_1], site_types[site_2]]
+            if cell_ind == 0:
+                is_neighb = is_neighb & (site_1 < site_2)
+                
+            site_1_list.append(site_1[is_neighb])
+            site_2_list.append(site_2[is_neighb])
+            cell_ind_list.append(cell_ind * np.ones(np.sum(is_neighb), dtype = int))
+        
+        site_1 = np.concatenate(site_1_list)
+        site_2 = np.concatenate(site_2_list)
+        cell_ind = np.concatenate(cell_ind_list)
+        order = np.lexsort((cell_ind, site_2, site_1))
+        
+        self.neighbor_list = [[int(i), int(j)] for i, j in zip(site_1[order], site_2[order])]
+        self.cell_list = [cell_names[i] for i in cell_ind[order]]     # self, north, northeast, east, or southeast
@@ -272,7 +272,7 @@ def ReadScaledown(RunPath, fldrs_cut = None, product = None, n_batches = 1000):
         
         x = Replicates()
         x.ParentFolder = os.path.join(RunPath, 'Iteration_' + str(ind))
-        x.ReadMultipleRuns()
+        x.ReadMultipleRuns(use_cache = True)
 
         if ind == 1:
             cum_batch = x
@@ -10,6 +10,9 @@ from KMC_Run import *
 from utils import *
 import time
 import scipy
+import scipy.sparse
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 
 class Replicates:
 
@@ -55,6 +58,9 @@ class Replicates:
         self.gas_product = None
         self.gas_prod_ind = None
         self.TOF_stoich = None
+        self.interp_ops = OrderedDict()         # Sparse interpolation operators for sets of bin edges, see interp_operator
+        self.interp_t = None                    # Times the interpolation operators were built for
+        self.max_interp_ops = 8                 # Number of interpolation operators kept
         
         # Rate and autocorrelation data
         self.rate = None
@@ -77,11 +83,17 @@ class Replicates:
         self.gas_product = kmc_temp.gas_prod
         
     
-    def BuildJobFiles(self, init_states = None):
+    def BuildJobFiles(self, init_states = None, link_mode = 'copy', n_threads = 8):
         
         '''
         Builds folders with Zacros input files. Each trajectory is assigned a different random seed.
+        The input files which are the same for all trajectories are written in the first folder
+        and copied or linked into the others.
         :param init_states: List of intial states for each trajectory.
+        :param link_mode: How the shared input files are put in the other folders: 'copy' for independent copies,
+            'hard' for hard links or 'sym' for symbolic links. Linked files must not be edited in a single folder,
+            because the edit changes them in every folder.
+        :param n_threads: Number of threads used to write the folders after the first one
         '''
         
         if not os.path.exists(self.ParentFolder):
@@ -89,37 +101,66 @@ class Replicates:
         ClearFolderContents(self.ParentFolder)    
         
         # List the directories and random seeds 
-        self.run_dirs = []
-        self.rand_seeds = []
-        seed = 5000
+        self.run_dirs = [os.path.join(self.ParentFolder, str(i+1)) for i in range(self.n_trajectories)]
+        self.rand_seeds = [5000 + i for i in range(self.n_trajectories)]
         
-        # Go through the directories and write input files for trajectories with
-        # different random seeds and possibly different initial states
-        for i in range(self.n_trajectories):
-            
-            # Set the random seed
-            self.runtemplate.simin.Seed = seed
-            self.rand_seeds.append(seed)
-            seed = seed + 1
-            
-            # Set the path
-            fldr = os.path.join(self.ParentFolder, str(i+1))
-            self.runtemplate.Path = fldr
-            self.run_dirs.append(fldr)
-            
-            # Set initial state
+        if self.n_trajectories == 0:
+            return
+        
+        def set_template(i):        # Set the random seed, path and initial state of a trajectory
+            self.runtemplate.simin.Seed = self.rand_seeds[i]
+            self.runtemplate.Path = self.run_dirs[i]
             if not init_states is None:
                 self.runtemplate.statein.Type = 'history'
                 self.runtemplate.statein.Struct = init_states[i]
                 
-            # Write input files in that folder
+        # Write all input files for the first trajectory
+        set_template(0)
+        if not os.path.exists(self.run_dirs[0]):
+            os.makedirs(self.run_dirs[0])
+        self.runtemplate.WriteAllInput()
+        
+        # Input files which do not depend on the seed or initial state
+        shared_files = [fname for fname in [self.runtemplate.mechin.fname, self.runtemplate.clusterin.fname, self.runtemplate.lat.fname_in]
+                        if os.path.isfile(os.path.join(self.run_dirs[0], fname))]
+                        
+        # simulation_input.dat only differs in the random seed, so it is rendered once
+        sim_template = self.runtemplate.simin.RenderIn(seed_field = '@SEED@')
+        surf_spec = self.runtemplate.simin.surf_spec
+        
+        def write_traj(i):
+            
+            fldr = self.run_dirs[i]
             if not os.path.exists(fldr):
                 os.makedirs(fldr)
                 
-            self.runtemplate.WriteAllInput()
+            with open(os.path.join(fldr, self.runtemplate.simin.fname), 'w') as txt:
+                txt.write(sim_template.replace('@SEED@', '{:15}'.format(str(self.rand_seeds[i]))))
+            
+            if init_states is None:
+                statein = self.runtemplate.statein
+            else:
+                statein = StateIn()
+                statein.Type = 'history'
+                statein.Struct = init_states[i]
+            statein.WriteIn(fldr, surf_spec)
+            
+            for fname in shared_files:
+                LinkFile(os.path.join(self.run_dirs[0], fname), os.path.join(fldr, fname), mode = link_mode)
+        
+        # Go through the other directories and write input files for trajectories with
+        # different random seeds and possibly different initial states
+        pool = ThreadPool(n_threads)
+        try:
+            pool.map(write_traj, range(1, self.n_trajectories))
+        finally:
+            pool.close()
+            pool.join()
+            
+        set_template(self.n_trajectories - 1)       # the template is left with the last trajectory
                 
     
-    def RunAllTrajectories_JobArray(self, max_cores = 100, server = 'Squidward', job_name = 'zacros_JA'):
+    def RunAllTrajectories_JobArray(self, max_cores = 100, server = 'Squidward', job_name = 'zacros_JA', monitor = False, use_marker = False):
     
         '''
         Runs a job array on Squidward or Farber
@@ -128,6 +169,8 @@ class Replicates:
         :param max_cores: Maximum number of cores to use
         :param server: Name of the server. Squidward and Farber are supported.
         :param job_name: Name of the job to put in the submit file.
+        :param monitor: Follow the output of the running trajectories and print their progress at each check
+        :param use_marker: Save a marker file in each finished run, so later checks of the run do not need to read general_output.txt
         '''
     
         sys.stdout.write('Running parallel jobs\n')
@@ -213,22 +256,58 @@ class Replicates:
         os.chdir(self.ParentFolder)
         os.system('qsub ' + os.path.join(self.ParentFolder, 'zacros_submit_JA.qs'))
     
-        # Wait for jobs to be done
-        all_jobs_done = False
+        # Wait for jobs to be done, only checking the folders which were not finished at the last check
+        running_dirs = list(self.run_dirs)
+        monitors = {}
+        if monitor:
+            monitors = {fldr: traj_monitor(fldr) for fldr in self.run_dirs}
         check_num = 1
-        while not all_jobs_done:
+        while running_dirs:
             time.sleep(60)
             check_num += 1
-            all_jobs_done = True
-            for fldr in self.run_dirs:
+            still_running = []
+            for fldr in running_dirs:
                 self.runtemplate.Path = fldr
-                if not self.runtemplate.CheckComplete():
-                    all_jobs_done = False
+                if not self.runtemplate.CheckComplete(use_marker = use_marker):
+                    still_running.append(fldr)
+                else:
+                    monitors.pop(fldr, None)        # finished runs are not followed anymore
+            running_dirs = still_running
+            
+            if monitor:
+                self.PrintProgress([monitors[fldr] for fldr in running_dirs])
                     
         sys.stdout.write('Jobs in ' + self.ParentFolder + ' have finished\n')
         sys.stdout.flush()
         
     
+    def PrintProgress(self, monitors):
+    
+        '''
+        Update the monitors of running trajectories and print their progress
+        
+        :param monitors: List of traj_monitor objects
+        '''
+        
+        ETAs = []
+        stalled = []
+        for mon in monitors:
+            mon.Update()
+            if mon.events_per_sec() == 0:
+                stalled.append(mon.Path)
+            ETA = mon.ETA()
+            if not ETA is None:
+                ETAs.append(ETA)
+                
+        sys.stdout.write(str(len(monitors)) + ' trajectories running')
+        if ETAs:
+            sys.stdout.write(', estimated time remaining: ' + '{0:.0f}'.format(np.max(ETAs)) + ' s')
+        sys.stdout.write('\n')
+        for fldr in stalled:
+            sys.stdout.write('No progress in ' + fldr + '\n')
+        sys.stdout.flush()
+        
+    
     def RunAllJobs_serial(self):       # Serial version of running all jobs
 
         '''
@@ -241,10 +320,24 @@ class Replicates:
             self.runtemplate.Run_sim()
             
     
-    def ReadMultipleRuns(self):
+    def ReadMultipleRuns(self, use_cache = False, mmap = False, n_time_pts = None, t_grid = None, write_bin = False):
         
         '''
         Read all Zacros jobs in a given folder
+        
+        :param use_cache: Load the parsed output of each trajectory from its zw_cache subfolder when it is up to date
+        
+        :param mmap: Keep the propensities, integrated propensities, trajectory derivatives and integrated
+            species of each trajectory in their files and stack them lazily with an ArrayStack. The files are
+            only opened while they are read, so any number of trajectories can be stacked.
+            
+        :param n_time_pts: Sample all trajectories at this many evenly spaced times, from 0 to the
+            earliest final time of the trajectories
+            
+        :param t_grid: Sample all trajectories at these times. Overrides n_time_pts.
+        
+        :param write_bin: Save text propensity, trajectory derivative and integrated species output
+            as binary files, so that later reads are faster
         '''
         
         sys.stdout.write('Reading all runs in ' + self.ParentFolder + '\n')
@@ -262,14 +355,30 @@ class Replicates:
                 full_direct = os.path.join(self.ParentFolder, direct)
                 dummy_run.Path = full_direct
                 
-                if dummy_run.CheckComplete():
+                if dummy_run.CheckComplete(use_marker = use_cache):
                     self.run_dirs.append(full_direct)
                     
             self.n_trajectories = len(self.run_dirs)
         
+        # Common time grid for all trajectories
+        if not t_grid is None or not n_time_pts is None:
+            
+            final_times = [dummy_run.specnumout.ReadFinalTime(traj_dir) for traj_dir in self.run_dirs]
+            final_times = [t for t in final_times if not t is None]         # runs without any records yet
+            if len(final_times) == 0:
+                raise Exception('No trajectories with specnum records found in ' + self.ParentFolder)
+            t_final = np.min(final_times)
+            
+            if t_grid is None:
+                t_grid = np.linspace(0, t_final, n_time_pts)
+            elif t_grid[-1] > t_final:
+                sys.stdout.write('Warning: t_grid ends at ' + str(t_grid[-1]) + ' but a trajectory ends at ' + str(t_final) + 
+                    ', its last values are used at the later times.\n')
+        
         # Create arrays for data
         # Use input data from runtemplate to properly size the arrays
         self.t_vec = []
+        t_vec_differs = False
         self.species_pops = []
         self.rxn_freqs = []
         self.History_final_snaps = []            # list of the final states
@@ -280,24 +389,31 @@ class Replicates:
         self.CPU_total = []
         self.time_avg_covs = []                   # surface species coverage based on time integral not including empty site
         
-        for traj_dir in self.run_dirs:
+        for traj_ind, traj_dir in enumerate(self.run_dirs):
 
             # Switch to folder and read output files
+            # The reaction network is the same for all trajectories, so it is only parsed until one has been read
             dummy_run.Path = traj_dir
-            dummy_run.ReadAllOutput()
+            dummy_run.ReadAllOutput(final_snap_only = True, use_cache = use_cache, mmap = mmap, read_network = dummy_run.genout.Nu is None,
+                t_grid = t_grid, write_bin = write_bin)     # only the final state is needed for continuation
             self.runtemplate = dummy_run            # so we have an example
             
             # Pass the data from this run into the larger data structures in 
             # so you will not have to store separate kmc_traj objects
             # The large arrays of data will be easier to process
             
+            if traj_ind > 0 and not np.array_equal(self.t_vec, dummy_run.specnumout.t):
+                t_vec_differs = True
             self.t_vec = np.array(dummy_run.specnumout.t )
             self.species_pops.append(dummy_run.specnumout.spec )
             self.rxn_freqs.append(dummy_run.procstatout.events )
             
-            if hasattr(dummy_run.histout, 'snapshots'):         # For some reason dummy_run.histout was not initializing properly...
-                if not dummy_run.histout.snapshots == []:
-                    self.History_final_snaps.append( dummy_run.histout.snapshots[-1] )
+            if not dummy_run.histout.final_snapshot is None:
+                self.History_final_snaps.append( dummy_run.histout.final_snapshot )
+            
+            if mmap:            # do not keep the files of every trajectory open
+                for field in dummy_run.mmap_fields:
+                    setattr(dummy_run, field, file_array(getattr(dummy_run, field)))
             
             self.propensities.append(dummy_run.prop)
             self.Props_integ.append(dummy_run.propCounter)
@@ -307,18 +423,30 @@ class Replicates:
             self.CPU_total.append( dummy_run.genout.CPU_time )
             self.time_avg_covs.append(dummy_run.spec_num_int)
         
+        if t_vec_differs:
+            sys.stdout.write('Warning: the trajectories were recorded at different times, the times of the last one are used. Use n_time_pts or t_grid to sample them at the same times.\n')
+            sys.stdout.flush()
+        
         # Convert the data from lists to arrays
         self.species_pops = np.array(self.species_pops)
         self.rxn_freqs = np.array(self.rxn_freqs)
-        self.propensities = np.array(self.propensities)
-        self.Props_integ = np.array(self.Props_integ)
-        self.traj_derivs = np.array(self.traj_derivs)
         self.events_total = np.array(self.events_total)
         self.CPU_total = np.array(self.CPU_total)
-        self.time_avg_covs = np.array(self.time_avg_covs)
+        
+        if mmap and not any(arr is None for arr in self.propensities + self.Props_integ + self.traj_derivs + self.time_avg_covs):
+            self.propensities = ArrayStack(self.propensities)
+            self.Props_integ = ArrayStack(self.Props_integ)
+            self.traj_derivs = ArrayStack(self.traj_derivs)
+            self.time_avg_covs = ArrayStack(self.time_avg_covs)
+        else:
+            self.propensities = np.array(self.propensities)
+            self.Props_integ = np.array(self.Props_integ)
+            self.traj_derivs = np.array(self.traj_derivs)
+            self.time_avg_covs = np.array(self.time_avg_covs)
         
         self.runAvg = copy.deepcopy(dummy_run)      # Initialize run average with information from dummyrun
         self.avg_updated = False
+        self.ClearInterpCache()
         
         
     def AverageRuns(self):
@@ -368,7 +496,66 @@ class Replicates:
         self.batch_length = self.t_vec[-1] / self.Nbpt
         
         
-    def Compute_rate(self, include_ACF_CI = True):
+    def interp_operator(self, bin_edges):
+    
+        '''
+        Build the sparse matrix which linearly interpolates data sampled at the trajectory times
+        to a set of bin edges. The last max_interp_ops operators are kept until the trajectory data changes.
+        
+        :param bin_edges: Times to interpolate to
+        :returns: Sparse matrix of size n_edges x n_times with the interpolation weights
+        '''
+        
+        bin_edges = np.asarray(bin_edges, dtype = float)
+        t = self.runAvg.specnumout.t
+        
+        if self.interp_t is None or not np.array_equal(self.interp_t, t):
+            self.ClearInterpCache()
+            self.interp_t = np.array(t)
+        
+        key = bin_edges.tobytes()
+        if not key in self.interp_ops:
+            inds, fracs = self.runAvg.time_search_interp_batch(bin_edges)
+            rows = np.repeat(np.arange(len(bin_edges)), 2)
+            self.interp_ops[key] = scipy.sparse.csr_matrix( (fracs.flatten(), (rows, inds.flatten())), shape = [len(bin_edges), len(t)] )
+            while len(self.interp_ops) > self.max_interp_ops:
+                self.interp_ops.popitem(last = False)          # drop the oldest
+        
+        return self.interp_ops[key]
+        
+        
+    def ClearInterpCache(self):
+    
+        '''
+        Remove the saved interpolation operators, e.g. when the trajectory data has changed
+        '''
+        
+        self.interp_ops = OrderedDict()
+        self.interp_t = None
+        
+        
+    def interp_data(self, data, bin_edges):
+    
+        '''
+        Linearly interpolate data from all trajectories to a set of bin edges
+        
+        :param data: Array of size n_trajectories x n_times x n_variables, e.g. Props_integ
+        :param bin_edges: Times to interpolate to
+        :returns: Array of size n_trajectories x n_edges x n_variables
+        '''
+        
+        op = self.interp_operator(bin_edges)
+        
+        if isinstance(data, ArrayStack):        # interpolate one trajectory at a time instead of loading all of them
+            return np.array([ op.dot(np.asarray(arr)) for arr in data.arrays ])
+        
+        data = np.asarray(data)
+        n_traj, n_times, n_vars = data.shape
+        flat = np.transpose(data, [1, 0, 2]).reshape([n_times, n_traj * n_vars])         # apply to all trajectories with one product
+        return np.transpose( op.dot(flat).reshape([-1, n_traj, n_vars]) , [1, 0, 2] )
+        
+        
+    def Compute_rate(self, include_ACF_CI = True, N_boot = 100, seed = None):
     
         '''
         Use batch means to compute the reaction rate (and confidence interval)
@@ -376,6 +563,8 @@ class Replicates:
         
         :params include_ACF_CI: Whether to use statistical bootstrapping to compute confidence intervals.
             This takes some CPU time.
+        :params N_boot: Number of bootstrap samples for the ACF confidence interval
+        :params seed: Seed of the random numbers used for bootstrapping. If None, numpy's global random state is used.
         :returns: The rate
         '''
         
@@ -385,17 +574,10 @@ class Replicates:
         self.Compute_batch_data()
             
         bin_edges = np.linspace(0, self.t_vec[-1], self.Nbpt + 1)
-        rate_data = np.zeros([self.n_trajectories, self.Nbpt])
         
-        for i in range(self.Nbpt):
-        
-            idb_start = self.runAvg.time_search_interp(bin_edges[i])
-            idb_end = self.runAvg.time_search_interp(bin_edges[i+1])
-            
-            prop_integ_start = idb_start[1][0] * self.Props_integ[:, idb_start[0][0], :] + idb_start[1][1] * self.Props_integ[:, idb_start[0][1], :]
-            prop_integ_end = idb_end[1][0] * self.Props_integ[:, idb_end[0][0], :] + idb_end[1][1] * self.Props_integ[:, idb_end[0][1], :]
-            
-            rate_data[:,i] = np.dot ( ( prop_integ_end - prop_integ_start ) / self.batch_length , self.TOF_stoich )
+        # Rates of all batches of all trajectories, n_trajectories x Nbpt
+        prop_integ_edges = self.interp_data(self.Props_integ, bin_edges)
+        rate_data = np.dot ( ( prop_integ_edges[:, 1:, :] - prop_integ_edges[:, :-1, :] ) / self.batch_length , self.TOF_stoich )
         
         
         '''
@@ -434,16 +616,14 @@ class Replicates:
                 Compute confidence interval for ACF
                 '''
                 
-                N_boot = 100
-                
-                ACF_dist = np.zeros(N_boot)
-                for i in range(N_boot):
-                    subpop_inds = np.random.randint(len(c1), size=len(c1))
-                    c1_new = c1[subpop_inds]
-                    c2_new = c2[subpop_inds]
-                    ACF_dist[i] = ( np.mean(c1_new * c2_new) - np.mean(c1_new) * np.mean(c2_new) ) / np.var(all_batch_rates)
+                # Draw all bootstrap samples at once, one row per sample
+                rand_gen = np.random if seed is None else np.random.RandomState(seed)
+                subpop_inds = rand_gen.randint(len(c1), size = [N_boot, len(c1)])
+                c1_new = c1[subpop_inds]
+                c2_new = c2[subpop_inds]
+                ACF_dist = ( np.mean(c1_new * c2_new, axis = 1) - np.mean(c1_new, axis = 1) * np.mean(c2_new, axis = 1) ) / np.var(all_batch_rates)
                     
-                ACF_dist = sorted(ACF_dist)
+                ACF_dist = np.sort(ACF_dist)
                 ACF_high = ACF_dist[int(0.95 * N_boot)]
                 ACF_low = ACF_dist[int(0.05 * N_boot)]
                 self.ACF_CI = (ACF_high - ACF_low) / 2
@@ -458,7 +638,7 @@ class Replicates:
         return self.rate
         
         
-    def PerformSA(self, delta_t = None, ergodic = True, dp_per_bin = 10):          # Need implement time point interpolation
+    def PerformSA(self, delta_t = None, ergodic = True, dp_per_bin = 10, N_boot = 100, seed = None):          # Need implement time point interpolation
         
         '''
         Perform likelihood ratio sensitivity analysis with a combination of time and trajectory averaging
@@ -468,7 +648,12 @@ class Replicates:
         :param ergodic:   True - average the rate over the entire time interval (centered ergodic likelihood ratio)
                     False - use the rate at the end of the time interval (centered likelihood ratio)
         
+        :param N_boot:    Number of bootstrap samples for the confidence intervals
+        
+        :param seed:      Seed of the random numbers used for bootstrapping. If None, numpy's global random state is used.
+        
          Data between sample points is estimated with linear interpolation
+         Sums over the data points are taken with array reductions, so results can differ from a sequential sum in the last digits
         '''
         
         self.Compute_batch_data()
@@ -489,119 +674,82 @@ class Replicates:
         bin_edges = np.linspace(0, self.t_vec[-1], self.Nbpt * dp_per_bin + 1)
         
         dp_per_traj = dp_per_bin * (self.Nbpt-1) + 1 
-        rate_data_erg = np.zeros( self.n_trajectories * dp_per_traj  )
-        W_data_all = np.zeros([ self.traj_derivs.shape[2] , self.n_trajectories * dp_per_traj ] )
-        fW_data = np.zeros( self.n_trajectories * dp_per_traj )
-        rate_contributions_all = np.zeros(self.traj_derivs.shape[2])
-         
-        
-        data_ind = 0
-        for traj_ind in range(self.n_trajectories):
-            for i in range(dp_per_traj):
-            
-                idb_start = self.runAvg.time_search_interp( bin_edges[i] )
-                idb_end = self.runAvg.time_search_interp( bin_edges[i+dp_per_bin] )
-                
-                W_start = idb_start[1][0] * self.traj_derivs[ traj_ind, idb_start[0][0] , :] + idb_start[1][1] * self.traj_derivs[ traj_ind, idb_start[0][1] , :]
-                W_end = idb_end[1][0] * self.traj_derivs[ traj_ind, idb_end[0][0] , :] + idb_end[1][1] * self.traj_derivs[ traj_ind, idb_end[0][1] , :]
-                W_data_all[:, data_ind] = W_end - W_start
-                
-                if not ergodic:
-                    idb_start = self.runAvg.time_search_interp( bin_edges[i+dp_per_bin-1] )
-                
-                if ergodic:
-                    prop_integ_start = idb_start[1][0] * self.Props_integ[traj_ind, idb_start[0][0], :] + idb_start[1][1] * self.Props_integ[traj_ind, idb_start[0][1], :]
-                    prop_integ_end = idb_end[1][0] * self.Props_integ[traj_ind, idb_end[0][0], :] + idb_end[1][1] * self.Props_integ[traj_ind, idb_end[0][1], :]
-                    rate_data_erg[data_ind] = np.dot ( ( prop_integ_end - prop_integ_start ) / self.batch_length , self.TOF_stoich )
-                    rate_contributions_all = rate_contributions_all + ( ( prop_integ_end - prop_integ_start ) / self.batch_length * self.TOF_stoich )
-                else:
-                    inst_rates = idb_end[1][0] * self.propensities[traj_ind, idb_end[0][0], :] + idb_end[1][1] * self.propensities[traj_ind, idb_end[0][1], :]
-                    rate_data_erg[data_ind] = np.dot ( inst_rates , self.TOF_stoich )
-                    rate_contributions_all = rate_contributions_all + ( inst_rates * self.TOF_stoich )
-                
-                data_ind += 1
+        n_dp = self.n_trajectories * dp_per_traj
+        
+        # Data point i of each trajectory is the window from bin edge i to bin edge i+dp_per_bin.
+        # Data points are ordered by trajectory, then by window.
+        derivs_edges = self.interp_data(self.traj_derivs, bin_edges)
+        W_data_all = derivs_edges[:, dp_per_bin:, :] - derivs_edges[:, :dp_per_traj, :]
+        W_data_all = W_data_all.reshape([n_dp, -1])                     # n_dp x n_rxns (forward and reverse)
+        
+        if ergodic:
+            prop_integ_edges = self.interp_data(self.Props_integ, bin_edges)
+            rate_contributions_dp = ( prop_integ_edges[:, dp_per_bin:, :] - prop_integ_edges[:, :dp_per_traj, :] ) / self.batch_length
+        else:
+            rate_contributions_dp = self.interp_data(self.propensities, bin_edges)[:, dp_per_bin:, :]            # instantaneous rates at the end of each window
+        
+        rate_contributions_dp = rate_contributions_dp.reshape([n_dp, -1])
+        rate_data_erg = np.dot ( rate_contributions_dp , self.TOF_stoich )
         
         # Normalize rate contributions by the number of data points
-        rate_contributions_all = rate_contributions_all / ( self.n_trajectories * dp_per_traj )
+        rate_contributions_all = np.sum( rate_contributions_dp * self.TOF_stoich , axis = 0 ) / n_dp
         
         # Combine forward and reverse reactions
-        W_data = np.zeros([self.runAvg.mechin.get_num_rxns(), self.n_trajectories * dp_per_traj])
-        rate_contributions = np.zeros(self.runAvg.mechin.get_num_rxns())
+        n_rxns = self.runAvg.mechin.get_num_rxns()
+        rxn_inds = np.zeros(W_data_all.shape[1], dtype = int)            # combined reaction of each column of W_data_all
+        rate_contributions = np.zeros(n_rxns)
         ind = 0
-        for i in range(self.runAvg.mechin.get_num_rxns()):
+        for i in range(n_rxns):
             
             rxn_and_var = self.runAvg.mechin.get_rxn_var_inds(i)
             
             if self.runAvg.mechin.rxn_list[rxn_and_var[0]].is_reversible:
-                W_data[i, :] = W_data_all[ind, :] + W_data_all[ind+1, :]
+                rxn_inds[ind:ind+2] = i
                 rate_contributions[i] = rate_contributions_all[ind] + rate_contributions_all[ind+1]
                 ind += 2
             else:
-                W_data[i, :] = W_data_all[ind, :]
+                rxn_inds[ind] = i
                 rate_contributions[i] = rate_contributions_all[i]
                 ind += 1
         
-        # Calculate NSCs
-        mean_rate = 0
-        W_mean = np.zeros( self.runAvg.mechin.get_num_rxns() )
-        NSCs = np.zeros(self.runAvg.mechin.get_num_rxns())
+        W_data = np.zeros([n_dp, n_rxns])
+        for col in range(ind):
+            W_data[:, rxn_inds[col]] += W_data_all[:, col]
+        
+        # Sum the rate, W and their product over data points with one reduction.
+        # Columns: rate, W for each reaction, rate * W for each reaction
+        dp_data = np.hstack([ rate_data_erg.reshape([n_dp, 1]), W_data, rate_data_erg.reshape([n_dp, 1]) * W_data ])
         
-        for dp in range( self.n_trajectories * dp_per_traj ):
-            mean_rate = mean_rate + rate_data_erg[dp]
-            W_mean = W_mean + W_data[ : , dp ]
-            NSCs = NSCs + rate_data_erg[dp] * W_data[ : , dp ]
+        def sums_to_NSCs(sums):         # sums has one row of sums over the data points for each sample
             
-        # Normalize means
-        mean_rate = mean_rate / ( self.n_trajectories * dp_per_traj )
-        W_mean = W_mean / ( self.n_trajectories * dp_per_traj )
-        NSCs = NSCs / ( self.n_trajectories * dp_per_traj )
+            # Normalize means
+            mean_rate = sums[:, 0:1] / n_dp
+            W_mean = sums[:, 1:n_rxns+1] / n_dp
+            NSCs = sums[:, n_rxns+1:] / n_dp
+            
+            NSCs = NSCs - W_mean * mean_rate + rate_contributions       # Convert from ELR to CELR
+            return NSCs / mean_rate     # normalize 
         
-        NSCs = NSCs - W_mean * mean_rate + rate_contributions       # Convert from ELR to CELR
-        NSCs = NSCs / mean_rate     # normalize 
+        NSCs = sums_to_NSCs( np.sum(dp_data, axis = 0).reshape([1, -1]) )[0, :]
 
         
         '''
         Compute error bounds on NSCs
         '''
         
-        N_boot = 100
+        rand_gen = np.random if seed is None else np.random.RandomState(seed)
+        subpop_inds = rand_gen.randint(n_dp, size = [N_boot, n_dp])        # one row of resampled data points per sample
         
+        # Resample in blocks of samples to limit the memory used
+        block_size = max(1, int( 1e7 / dp_data.size ))
         NSC_sam = np.zeros([ N_boot , len(NSCs) ])
-        for i in range(N_boot):
-        
-            # Prepare new set of data
-            subpop_inds = np.random.randint(self.n_trajectories * dp_per_traj, size = self.n_trajectories * dp_per_traj )
-            
-            rate_data_erg_sub = rate_data_erg[subpop_inds]
-            W_sub = W_data[:, subpop_inds]
-            
-            # Calculate NSCs
-            mean_rate = 0
-            W_mean = np.zeros(self.runAvg.mechin.get_num_rxns())
-            NSCsub = np.zeros(self.runAvg.mechin.get_num_rxns())
-            
-            for dp in range( self.n_trajectories * dp_per_traj ):
-                mean_rate = mean_rate + rate_data_erg_sub[dp]
-                W_mean = W_mean + W_sub[ : , dp ]
-                NSCsub = NSCsub + rate_data_erg_sub[dp] * W_sub[ : , dp ]
-                
-            # Normalize means
-            mean_rate = mean_rate / ( self.n_trajectories * dp_per_traj )
-            W_mean = W_mean / ( self.n_trajectories * dp_per_traj )
-            NSCsub = NSCsub / ( self.n_trajectories * dp_per_traj )
-            
-            NSCsub = NSCsub - W_mean * mean_rate + rate_contributions       # Convert from ELR to CELR
-            NSCsub = NSCsub / mean_rate     # normalize 
-            
-            NSC_sam[i,:] = NSCsub
+        for block_start in range(0, N_boot, block_size):
+            block_inds = subpop_inds[block_start:block_start+block_size, :]
+            NSC_sam[block_start:block_start+block_size, :] = sums_to_NSCs( np.sum(dp_data[block_inds, :], axis = 1) )
         
         # Sort each column of the data and compute confidence interval
-        NSC_ci = np.zeros(NSCs.shape)
-        for rxn_ind in range(len(NSCs)):
-            NSC_dist = sorted(NSC_sam[:,rxn_ind])
-            NSC_dist_high = NSC_dist[int(0.95 * N_boot)]
-            NSC_dist_low = NSC_dist[int(0.05 * N_boot)]
-            NSC_ci[rxn_ind] = (NSC_dist_high - NSC_dist_low) / 2
+        NSC_sam = np.sort(NSC_sam, axis = 0)
+        NSC_ci = ( NSC_sam[int(0.95 * N_boot), :] - NSC_sam[int(0.05 * N_boot), :] ) / 2
         
         self.NSC = NSCs
         self.NSC_ci = NSC_ci
@@ -673,6 +821,11 @@ def append_replicates(batch1, batch2):
     
     sand = copy.deepcopy(batch2)
     
+    # Memory-mapped data is read-only, so load it before adding to it
+    for attr in ['propensities', 'Props_integ', 'traj_derivs', 'time_avg_covs']:
+        if isinstance(getattr(sand, attr), ArrayStack):
+            setattr(sand, attr, np.array(getattr(sand, attr)))
+    
     sand.t_vec = np.hstack( [ batch1.t_vec, batch2.t_vec[1::] + batch1.t_vec[-1]] ) 
     
     #sand.History_final_snaps = batch2.History_final_snaps          # history will already have been copied
@@ -703,5 +856,6 @@ def append_replicates(batch1, batch2):
     sand.traj_derivs = np.concatenate( [batch1.traj_derivs, sand.traj_derivs[:,1::,:]], axis = 1 )
     
     sand.avg_updated = False
+    sand.ClearInterpCache()
         
     return sand
\ No newline at end of file
@@ -3,6 +3,7 @@
 from itertools import (takewhile,repeat)
 import numpy as np
 import os, shutil
+import mmap
 import matplotlib as mat
 import matplotlib.pyplot as plt
 import scipy.stats
@@ -78,18 +79,28 @@ def PadStr(string,num):
 
 
 def ReturnUnique(Matrix):
-    Matrix = np.array(Matrix)
+
+    '''
+    Find the unique rows of a stoichiometry matrix. The rows are sorted, then each row
+    is followed by its reverse (negative) if it exists.
+    '''
+    
+    Matrix = np.ascontiguousarray(Matrix)
     ncols = Matrix.shape[1]
     dtype = Matrix.dtype.descr * ncols
     struct = Matrix.view(dtype)
     
     uniq = np.unique(struct)
     uniq = uniq.view(Matrix.dtype).reshape(-1, ncols)
-    for i in range(0,uniq.shape[0]-2):
-        for j in range(i+2,uniq.shape[0]):
-            if np.array_equal(uniq[i],-uniq[j]):
-                uniq[j,:] = uniq[i+1,:]
-                uniq[i+1,:] = -uniq[i,:]
+    
+    # Move the reverse of each row next to it
+    position = {row.tobytes(): ind for ind, row in enumerate(uniq)}
+    for i in range(0, uniq.shape[0]-2):
+        j = position.get((-uniq[i]).tobytes())
+        if not j is None and j >= i+2:
+            position[uniq[i+1].tobytes()] = j
+            position[uniq[j].tobytes()] = i+1
+            uniq[[i+1, j], :] = uniq[[j, i+1], :]
     uniq = uniq.astype(int)  
     return uniq
 
@@ -101,6 +112,212 @@ def rawbigcount(filename):
         bufgen = takewhile(lambda x: x, (f.read(1024*1024) for _ in repeat(None)))
         nLines = sum( buf.count(b'\n') for buf in bufgen if buf )
     return nLines
+
+
+def line_offsets(filename, key):
+    
+    '''
+    Find the byte offsets of every line in a file which starts with a given string.
+    The file is searched in large binary blocks, so it is never split into lines.
+    
+    :param filename: Name of the file to search
+    
+    :param key: String at the start of the lines to find
+    
+    :returns: List of byte offsets of the matching lines
+    '''
+    
+    key = key.encode()
+    pattern = b'\n' + key
+    offsets = []
+    with open(filename, 'rb') as f:
+        buf = f.read(1024*1024)
+        if buf.startswith(key):
+            offsets.append(0)
+        base = 0                        # file position of the start of buf
+        while buf:
+            pos = buf.find(pattern)
+            while pos != -1:
+                offsets.append(base + pos + 1)
+                pos = buf.find(pattern, pos + 1)
+            carry = buf[1 - len(pattern):]          # catch a match split across blocks
+            base = base + len(buf) - len(carry)
+            new_buf = f.read(1024*1024)
+            if not new_buf:
+                break
+            buf = carry + new_buf
+    return offsets
+
+class FileArray(object):
+    
+    '''
+    Read-only array stored in a binary file. The file is memory-mapped only while the array is
+    indexed and closed again, so many of these can exist without keeping their files open.
+    '''
+    
+    def __init__(self, fname, dtype, shape, offset = 0, fortran_order = False):
+    
+        '''
+        :param fname: Name of the file
+        
+        :param dtype: Data type of the values
+        
+        :param shape: Shape of the array
+        
+        :param offset: Position of the first value in the file, in bytes
+        
+        :param fortran_order: True if the values are stored in Fortran order
+        '''
+        
+        self.fname = fname
+        stats = os.stat(fname)
+        self.file_id = (stats.st_ino, stats.st_mtime)         # to detect a file which was replaced later
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(int(n) for n in shape)
+        self.offset = offset
+        self.fortran_order = fortran_order
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+        
+    def __len__(self):
+        return self.shape[0]
+        
+    def __getitem__(self, key):
+        
+        '''
+        Read the indexed values into memory
+        '''
+        
+        if int(np.prod(self.shape)) == 0:         # empty files cannot be mapped
+            return np.zeros(self.shape, dtype = self.dtype)[key]
+        
+        stats = os.stat(self.fname)
+        if not (stats.st_ino, stats.st_mtime) == self.file_id:
+            raise IOError(self.fname + ' has been replaced since the array was opened. Read the output again.')
+        
+        arr = np.memmap(self.fname, dtype = self.dtype, mode = 'r', offset = self.offset, shape = self.shape,
+                        order = 'F' if self.fortran_order else 'C')
+        values = np.array(arr[key])
+        del arr                 # closes the file
+        return values
+        
+    def __array__(self, dtype = None):
+        values = self[...]
+        if not dtype is None:
+            values = values.astype(dtype)
+        return values
+        
+        
+def file_array(arr):
+    
+    '''
+    Convert a memory-mapped array into a FileArray, which does not keep its file open
+    
+    :param arr: Array
+    
+    :returns: FileArray if arr is a contiguous view of a whole memory-mapped file region, otherwise arr
+    '''
+    
+    if isinstance(arr, np.memmap) and not arr.filename is None and arr._mmap is not None and \
+        (arr.flags.c_contiguous or arr.flags.f_contiguous):
+        
+        # The mapping starts at a multiple of the allocation granularity before the offset the array was opened with
+        map_start = arr.offset - arr.offset % mmap.ALLOCATIONGRANULARITY
+        map_address = np.frombuffer(arr._mmap, dtype = np.uint8).ctypes.data
+        
+        return FileArray(arr.filename, arr.dtype, arr.shape, offset = map_start + arr.ctypes.data - map_address,
+                         fortran_order = arr.flags.f_contiguous and not arr.flags.c_contiguous)
+    return arr
+    
+    
+def ReplaceFile(src, dst):
+    
+    '''
+    Rename a file over an existing one. On Windows, os.rename fails when the destination
+    exists, so it is removed first.
+    '''
+    
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+class ArrayStack(object):
+    
+    '''
+    Stack of equally shaped arrays, such as the FileArray outputs of several trajectories,
+    which is indexed like the array np.array(arrays) without copying all of the data into memory.
+    Only the parts which are indexed are read.
+    '''
+    
+    def __init__(self, arrays):
+    
+        '''
+        :param arrays: List of arrays with the same shape
+        '''
+        
+        self.arrays = list(arrays)
+        
+    @property
+    def shape(self):
+        return (len(self.arrays),) + self.arrays[0].shape
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+        
+    @property
+    def dtype(self):
+        return self.arrays[0].dtype
+        
+    def __len__(self):
+        return len(self.arrays)
+        
+    def __getitem__(self, key):
+    
+        '''
+        The first index selects the arrays and the rest are applied to each of them
+        '''
+        
+        if not isinstance(key, tuple):
+            key = (key,)
+        rest = key[1:]
+        
+        if isinstance(key[0], (int, np.integer)):
+            return np.array(self.arrays[key[0]][rest])
+        
+        inds = np.arange(len(self.arrays))[key[0]]
+        return np.array([self.arrays[i][rest] for i in inds])
+        
+    def __array__(self, dtype = None):
+        return np.array([np.asarray(arr) for arr in self.arrays], dtype = dtype)
+        
+    def mean(self, axis = None, dtype = None, out = None, **kwargs):
+    
+        '''
+        Average over the stack without stacking the arrays when axis = 0
+        '''
+        
+        if not axis == 0:
+            return np.mean(np.array(self), axis = axis, dtype = dtype, out = out, **kwargs)
+        
+        total = np.array(self.arrays[0], dtype = np.float64)
+        for arr in self.arrays[1:]:
+            total += np.asarray(arr)
+        total /= len(self.arrays)
+        if not dtype is None:
+            total = total.astype(dtype)
+        if not out is None:
+            out[...] = total
+            return out
+        return total
+    
     
 # Handle clearing a folder when running in parallel
 
@@ -121,6 +338,38 @@ def ClearFolderContents(fldr_name):
             print(e)
 
 
+def LinkFile(src, dst, mode = 'hard'):
+    
+    '''
+    Make a file available at a second path without writing it again
+    
+    :param src: Existing file
+    
+    :param dst: New path
+    
+    :param mode: 'hard' - hard link, 'sym' - relative symbolic link, 'copy' - copy the file.
+        Links which cannot be made, e.g. across file systems, fall back to a copy.
+    '''
+    
+    if not mode in ['hard', 'sym', 'copy']:
+        raise ValueError('Link mode must be hard, sym or copy.')
+    
+    if os.path.lexists(dst):
+        os.remove(dst)
+    
+    try:
+        if mode == 'hard':
+            os.link(src, dst)
+            return
+        elif mode == 'sym':
+            os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+            return
+    except (OSError, AttributeError):        # AttributeError if the OS does not have links
+        pass
+        
+    shutil.copyfile(src, dst)
+
+
 def PlotOptions():
 
     '''